@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import ucorobot
+
+CTR_PARAMS = [0.03, 0.1, 1.0, 40, 2.0, 0.5, 5e5, 80]
+
+
+def arena(seed, size_in, near=False):
+    rng = np.random.default_rng(seed)
+    robot_POSE = np.c_[rng.uniform(0, 640, (size_in, 2)), rng.uniform(-180, 180, size_in)]
+    robot_GOAL = np.c_[rng.uniform(0, 640, (size_in, 2)), rng.uniform(-180, 180, size_in)]
+    if near:
+        #-- Goals inside d0 exercise the precompensation and final heading law
+        robot_GOAL[:, 0:2] = robot_POSE[:, 0:2] + rng.uniform(-30, 30, (size_in, 2))
+    return robot_POSE, robot_GOAL
+
+
+@pytest.mark.parametrize("version, scalar", [(1, "MIMC_VADOC_multiple"), (2, "MIMC_VADOC_multiple_2")])
+@pytest.mark.parametrize("seed", range(10))
+def test_batch_matches_scalar(version, scalar, seed):
+    size_in = 1 + seed*3
+    robot_POSE, robot_GOAL = arena(seed, size_in, near=seed % 3 == 0)
+
+    ucorobot.wl = np.zeros(size_in)
+    ucorobot.wr = np.zeros(size_in)
+    ucorobot.F = np.zeros((size_in, 2))
+    getattr(ucorobot, scalar)(robot_POSE, list(range(size_in)), robot_GOAL, CTR_PARAMS)
+
+    wl = np.zeros(size_in)
+    wr = np.zeros(size_in)
+    F = np.zeros((size_in, 2))
+    ucorobot.MIMC_VADOC_batch(robot_POSE, robot_GOAL, CTR_PARAMS, wl, wr, F, version=version)
+
+    np.testing.assert_allclose(wl, ucorobot.wl, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(wr, ucorobot.wr, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(F, ucorobot.F, rtol=1e-9, atol=1e-9)
+
+
+
+@pytest.mark.parametrize("size_in", [1, 2, 7, 60, 300])
+@pytest.mark.parametrize("offset", [0.0, -500.0])
+def test_grid_repulsion_matches_pairs(size_in, offset):
+    rng = np.random.default_rng(size_in)
+    kr, L0 = CTR_PARAMS[6], CTR_PARAMS[7]
+    #-- Dense arena so most robots have neighbours inside L0
+    side = 40*np.sqrt(size_in)
+    robot_POSE = np.c_[rng.uniform(0, side, (size_in, 2)) + offset, rng.uniform(-180, 180, size_in)]
+    #-- Coincident robots contribute nothing to each other
+    robot_POSE[size_in//2:size_in//2 + 2, 0:2] = robot_POSE[0, 0:2]
+
+    for _ in range(2):
+        #-- Second pass reuses the previous grid order on moved robots
+        pairs = ucorobot.MIMC_VADOC_repulsion(robot_POSE, kr, L0, "pairs")
+        grid = ucorobot.MIMC_VADOC_repulsion(robot_POSE, kr, L0, "grid")
+        np.testing.assert_allclose(grid, pairs, rtol=1e-9, atol=1e-9)
+        assert np.isfinite(grid).all()
+        robot_POSE[:, 0:2] += rng.normal(0, 10, (size_in, 2))
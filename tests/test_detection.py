@@ -0,0 +1,21 @@
+import time
+
+import numpy as np
+import pytest
+
+import ucorobot
+
+
+def test_dead_worker_does_not_hang():
+    #-- Unknown dictionary, the worker dies before taking any frame
+    ucorobot.initialize_detection(workers=1, slots=2, shape=(8, 8), mtx=np.eye(3),
+                                  dist=np.zeros(5), dct="aruco.NO_SUCH_DICT")
+    try:
+        assert ucorobot.submit_frame(np.zeros((8, 8), dtype=np.uint8)) == 0
+
+        t0 = time.monotonic()
+        with pytest.raises(SystemExit):
+            ucorobot.get_detections()
+        assert time.monotonic() - t0 < 10
+    finally:
+        ucorobot.detection_close()
@@ -0,0 +1,42 @@
+import numpy as np
+
+import ucorobot
+
+
+def track(t):
+    #-- Constant velocity robot turning through the +-180 seam at t = 1/3 s
+    return np.array([100 + 60*t, 400 - 30*t, ucorobot.wrap_angle(150 + 90*t)])
+
+
+def test_constant_velocity_across_angle_seam():
+    ucorobot.initialize_filter(3)
+    t0 = 1000.0
+    for k in range(61):
+        t = k/30
+        #-- Robot 1 sits still, its heading reads jitter across the seam
+        robot_POSE = np.array([track(t), [50, 50, 179.5 if k % 2 else -179.5], [0, 0, 0]])
+        #-- Robot 2 is never seen
+        ucorobot.filter_update(robot_POSE, np.array([True, True, False]), t0 + t)
+
+    np.testing.assert_allclose(ucorobot.kf_v[0], [60, -30, 90], atol=0.5)
+    assert np.abs(ucorobot.kf_v[1]).max() < 5
+    assert abs(ucorobot.kf_x[1, 2]) > 179
+
+    t_last = t0 + 2.0
+    pose, age, cov = ucorobot.filter_predict(t_last + 0.5, lead=0.1)
+
+    #-- 2.6 s along the track: heading 150 + 234 = 384 --> 24 deg
+    np.testing.assert_allclose(pose[0], track(2.6), atol=0.5)
+    assert -180 <= pose[0, 2] < 180
+    np.testing.assert_allclose(pose[1, 0:2], [50, 50])
+    assert abs(pose[1, 2]) > 175
+    np.testing.assert_allclose(age[0:2], 0.5)
+    assert age[2] == np.inf
+
+    assert cov.shape == (3, 6, 6)
+    np.testing.assert_allclose(cov, cov.transpose(0, 2, 1))
+    assert (np.diagonal(cov[0:2], axis1=1, axis2=2) > 0).all()
+    #-- Extrapolating further only grows the position uncertainty
+    variance = cov[0, [0, 1, 2], [0, 1, 2]].copy()
+    cov = ucorobot.filter_predict(t_last + 1.0)[2]
+    assert (cov[0, [0, 1, 2], [0, 1, 2]] > variance).all()
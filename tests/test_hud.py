@@ -0,0 +1,25 @@
+import cv2
+import numpy as np
+import pytest
+
+import ucorobot
+
+
+def legend_reference(frame, row, color, text):
+    h = frame.shape[0]
+    y1 = h - 15 - 30*row
+    cv2.rectangle(frame, (15, y1), (300, y1 - 30), (255, 255, 255), -1)
+    cv2.rectangle(frame, (20, y1 - 5), (60, y1 - 25), color, -1)
+    cv2.putText(frame, text, (70, y1 - 10), cv2.FONT_HERSHEY_DUPLEX, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
+
+
+@pytest.mark.parametrize("shape", [(480, 640, 3), (76, 301, 3), (60, 200, 3), (40, 120, 3), (10, 10, 3)])
+@pytest.mark.parametrize("row", [0, 1])
+def test_cached_legend_matches_cv2_clipping(shape, row):
+    frame = np.zeros(shape, dtype=np.uint8)
+    expected = frame.copy()
+
+    ucorobot.hud_legend(frame, row, (0, 255, 0), "POSE PARAMETERS")
+    legend_reference(expected, row, (0, 255, 0), "POSE PARAMETERS")
+
+    np.testing.assert_array_equal(frame, expected)
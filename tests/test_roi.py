@@ -0,0 +1,85 @@
+import numpy as np
+
+import ucorobot
+
+SHAPE = (240, 320)
+
+
+class FakeAruco:
+
+    #-- Markers are filled squares of value ID + 1, found wherever the image
+    #-- (full frame or ROI view) contains them
+    def __init__(self):
+        self.full = 0
+
+    def detectMarkers(self, image, aruco_dict, parameters=None, cameraMatrix=None, distCoeff=None):
+        if image.shape == SHAPE:
+            self.full += 1
+        corners, ids = [], []
+        for v in np.unique(image[image > 0]):
+            y, x = np.nonzero(image == v)
+            x0, x1, y0, y1 = x.min(), x.max(), y.min(), y.max()
+            corners.append(np.array([[[x0, y0], [x1, y0], [x1, y1], [x0, y1]]], dtype=np.float32))
+            ids.append([int(v) - 1])
+        if not ids:
+            return (), None, ()
+        return tuple(corners), np.array(ids, dtype=np.int32), ()
+
+
+def scene(centers):
+    gray = np.zeros(SHAPE, dtype=np.uint8)
+    for marker_id, (x, y) in centers.items():
+        gray[y - 5:y + 6, x - 5:x + 6] = marker_id + 1
+    return gray
+
+
+def setup(monkeypatch, robot_IDS):
+    size_in = len(robot_IDS)
+    fake = FakeAruco()
+    monkeypatch.setattr(ucorobot, "aruco", fake)
+    monkeypatch.setattr(ucorobot, "aruco_dict", None, raising=False)
+    monkeypatch.setattr(ucorobot, "parameters", None, raising=False)
+    store = np.zeros(size_in, dtype=ucorobot.POSE_DTYPE)
+    for name, value in (("robot_STORE", store), ("robot_POSE_A", store["pixel"]),
+                        ("robot_POSE_B", store["metric"]), ("robot_POSE_C", store["floor"]),
+                        ("robot_slot", ucorobot.slot_table(robot_IDS)),
+                        ("roi_center", np.zeros((size_in, 2))), ("roi_prev", np.zeros((size_in, 2))),
+                        ("roi_extent", np.zeros(size_in)), ("roi_valid", np.zeros(size_in, dtype=bool)),
+                        ("roi_count", 0), ("roi_last_full", 0)):
+        monkeypatch.setattr(ucorobot, name, value, raising=False)
+    return fake
+
+
+def test_out_of_view_robot_keeps_roi_tracking(monkeypatch):
+    fake = setup(monkeypatch, [1, 2, 3])
+    paths = []
+    for k in range(40):
+        #-- Robot 3 is parked off the arena for the whole run
+        gray = scene({1: (40 + k, 50), 2: (200, 150 - k)})
+        pose, path = ucorobot.get_pose_roi(gray, 0, None, None, full_every=30, retry_every=10)
+        paths.append(path)
+        np.testing.assert_allclose(pose[0:2, 0:2], [[40 + k, 50], [200, 150 - k]])
+
+    assert [k for k, p in enumerate(paths) if p == "full"] == [0, 10, 20, 30]
+    assert fake.full == 4
+    np.testing.assert_array_equal(ucorobot.roi_valid, [True, True, False])
+
+
+def test_lost_robot_gets_one_immediate_full_pass(monkeypatch):
+    fake = setup(monkeypatch, [1, 2])
+    paths = []
+    for k in range(25):
+        centers = {1: (40 + k, 50)}
+        if k < 5:
+            centers[2] = (200, 150)
+        paths.append(ucorobot.get_pose_roi(scene(centers), 0, None, None, retry_every=10)[1])
+
+    #-- Missed in its ROI at frame 5, then searched for on the retry schedule
+    assert [k for k, p in enumerate(paths) if p == "full"] == [0, 5, 15]
+    np.testing.assert_array_equal(ucorobot.roi_valid, [True, False])
+
+    #-- Back in view, picked up by the next scheduled pass
+    path = ucorobot.get_pose_roi(scene({1: (65, 50), 2: (100, 100)}), 0, None, None, retry_every=10)[1]
+    assert path == "full" and ucorobot.roi_valid.all()
+    path = ucorobot.get_pose_roi(scene({1: (66, 50), 2: (100, 100)}), 0, None, None, retry_every=10)[1]
+    assert path == "roi"
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import ucorobot
+
+INIT_GOAL = [[0, 0, 0], [1, 1, 1]]
+
+
+@pytest.fixture
+def goal_file(tmp_path):
+    path = tmp_path / "goals.csv"
+    #-- Out of order rows and blank lines, angles across the +-180 seam
+    path.write_text("0:0:2:0,100,100,170,200,200,0\n"
+                    "\n"
+                    "0:0:1:5,50,50,0,60,60,0\n"
+                    "\n"
+                    "0:0:4:0,300,100,-170,200,400,90\n")
+    return str(path)
+
+
+def test_compiled_timeline(goal_file):
+    ucorobot.initialize_seq(INIT_GOAL, goal_file)
+
+    np.testing.assert_array_equal(ucorobot.seq_times, [1.5, 2.0, 4.0])
+    assert ucorobot.seq_goals.shape == (3, 2, 3)
+
+
+def test_step_lookup(goal_file):
+    ucorobot.initialize_seq(INIT_GOAL, goal_file)
+
+    #-- Before the first waypoint the initial goal holds
+    np.testing.assert_array_equal(ucorobot.goal_seq_time(0.0), INIT_GOAL)
+    np.testing.assert_array_equal(ucorobot.goal_seq_time(1.9), [[50, 50, 0], [60, 60, 0]])
+    #-- A late query lands on the right waypoint instead of skipping it
+    np.testing.assert_array_equal(ucorobot.goal_seq_time(3.99), [[100, 100, 170], [200, 200, 0]])
+    np.testing.assert_array_equal(ucorobot.goal_seq_time(100.0), [[300, 100, -170], [200, 400, 90]])
+    assert ucorobot.time_count == 3
+    #-- Going back in time returns the initial goal again, rows are untouched
+    np.testing.assert_array_equal(ucorobot.goal_seq_time(1.0), INIT_GOAL)
+    np.testing.assert_array_equal(ucorobot.seq_goals[0], [[50, 50, 0], [60, 60, 0]])
+
+
+def test_heading_interpolation_wraps(goal_file):
+    ucorobot.initialize_seq(INIT_GOAL, goal_file, "heading")
+
+    goal = ucorobot.goal_seq_time(3.0)
+    #-- 170 --> -170 turns through 180, not through 0
+    np.testing.assert_allclose(goal[0], [200, 100, -180])
+    np.testing.assert_allclose(goal[1], [200, 300, 45])
+
+    ucorobot.initialize_seq(INIT_GOAL, goal_file, "linear")
+    np.testing.assert_allclose(ucorobot.goal_seq_time(3.0)[0], [200, 100, 0])
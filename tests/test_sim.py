@@ -0,0 +1,53 @@
+import numpy as np
+
+import ucorobot
+
+CTR_PARAMS = [0.03, 0.1, 1.0, 40, 2.0, 0.5, 1.0, 80]
+
+
+def test_kinematics():
+    ucorobot.initialize_sim([[100, 100, 0], [100, 100, 90], [200, 200, 0]], CTR_PARAMS, dt=0.1, scale=100)
+    ucorobot.sim_step(np.array([10.0, 10.0, -10.0]), np.array([10.0, 10.0, 10.0]))
+
+    #-- 0.3 m/s forward along +x and up the image, the third robot spins in place
+    np.testing.assert_allclose(ucorobot.sim_true[0], [103, 100, 0], atol=1e-9)
+    np.testing.assert_allclose(ucorobot.sim_true[1], [100, 97, 90], atol=1e-9)
+    np.testing.assert_allclose(ucorobot.sim_true[2], [200, 200, np.degrees(0.6)], atol=1e-9)
+
+
+def test_latency_delays_measurements():
+    ucorobot.initialize_sim([[0, 0, 0]], CTR_PARAMS, dt=0.1, scale=100, latency=0.2)
+    for _ in range(3):
+        ucorobot.sim_step(np.array([10.0]), np.array([10.0]))
+
+    pose = ucorobot.sim_get_pose()
+    np.testing.assert_allclose(pose[0], [3, 0, 0], atol=1e-9)
+    np.testing.assert_allclose(ucorobot.robot_STORE['stamp'][0], 0.1)
+
+
+def test_closed_loop_reaches_goals():
+    rng = np.random.default_rng(3)
+    size_in = 12
+    robot_POSE = np.c_[rng.uniform(0, 1000, (size_in, 2)), rng.uniform(-180, 180, size_in)]
+    robot_GOAL = np.c_[rng.uniform(0, 1000, (size_in, 2)), np.zeros(size_in)]
+
+    ucorobot.initialize_sim(robot_POSE, CTR_PARAMS, noise=(0.5, 1.0), latency=1/30, dropout=0.05, seed=0)
+    traj, cmd = ucorobot.sim_run(robot_GOAL, CTR_PARAMS, 900)
+
+    assert traj.shape == (901, size_in, 3) and cmd.shape == (900, size_in, 2)
+    start = np.hypot(*(robot_POSE[:, 0:2] - robot_GOAL[:, 0:2]).T)
+    final = np.hypot(*(traj[-1, :, 0:2] - robot_GOAL[:, 0:2]).T)
+    #-- The controller parks robots around d0 of their goal
+    assert start.min() > 100
+    assert final.max() < CTR_PARAMS[3]
+
+
+def test_stamp_matches_rounded_latency():
+    #-- 0.05 s rounds to two 1/30 s steps, the stamp follows the real delay
+    ucorobot.initialize_sim([[0, 0, 0]], CTR_PARAMS, dt=1/30, scale=100, latency=0.05)
+    for _ in range(5):
+        ucorobot.sim_step(np.array([10.0]), np.array([10.0]))
+
+    pose = ucorobot.sim_get_pose()
+    np.testing.assert_allclose(pose[0], [3, 0, 0], atol=1e-9)
+    np.testing.assert_allclose(ucorobot.robot_STORE['stamp'][0], 3/30)
@@ -0,0 +1,44 @@
+import numpy as np
+
+import ucorobot
+
+CTR_PARAMS = [0.03, 0.1, 1.0, 40, 2.0, 0.5, 1.0, 80]
+
+
+def scenario():
+    rng = np.random.default_rng(5)
+    size_in = 6
+    start = np.c_[rng.uniform(0, 800, (size_in, 2)), rng.uniform(-180, 180, size_in)]
+    goal = np.c_[rng.uniform(0, 800, (size_in, 2)), np.zeros(size_in)]
+    return {'start': start, 'goal': goal, 'duration': 8.0,
+            'noise': (0.5, 1.0), 'latency': 1/30, 'seed': 1, 'tolerance': 60}
+
+
+def test_sweep_params_grid_and_samples():
+    sets = ucorobot.sweep_params(CTR_PARAMS, grid={'ks': [0.5, 1.0], 'kw': [1, 2, 4]},
+                                 ranges={'U_max': (0.2, 0.8)}, samples=3, seed=0)
+
+    assert sets.shape == (9, 8)
+    np.testing.assert_array_equal(sets[0:6, 2], [0.5, 0.5, 0.5, 1.0, 1.0, 1.0])
+    np.testing.assert_array_equal(sets[0:6, 4], [1, 2, 4, 1, 2, 4])
+    assert ((sets[6:, 5] >= 0.2) & (sets[6:, 5] <= 0.8)).all()
+
+
+def test_pool_matches_serial():
+    sets = ucorobot.sweep_params(CTR_PARAMS, grid={'kw': [1, 2, 4]})
+    serial = ucorobot.sweep(sets, scenario(), jobs=1)
+    pooled = ucorobot.sweep(sets, scenario(), jobs=2)
+
+    for name in ('params', 'time_to_goal', 'min_distance', 'effort', 'oscillation'):
+        np.testing.assert_array_equal(serial[name], pooled[name])
+    assert np.isfinite(serial['effort']).all() and (serial['min_distance'] > 0).all()
+
+
+def test_serial_sweep_keeps_session_state():
+    ucorobot.initialize_sim([[10, 10, 0], [20, 20, 0]], CTR_PARAMS)
+    store, wl, sim_true = ucorobot.robot_STORE, ucorobot.wl, ucorobot.sim_true
+
+    ucorobot.sweep(CTR_PARAMS, scenario(), jobs=1)
+
+    assert ucorobot.robot_STORE is store and ucorobot.wl is wl and ucorobot.sim_true is sim_true
+    assert np.shares_memory(ucorobot.robot_POSE_A, store)
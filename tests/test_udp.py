@@ -0,0 +1,136 @@
+import socket
+import time
+
+import numpy as np
+
+import ucorobot
+
+
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def wait_acks(expected, timeout=2.0):
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < timeout:
+        stats = ucorobot.link_stats()
+        if (stats["acked"] >= expected).all():
+            break
+        time.sleep(0.01)
+    return ucorobot.link_stats()
+
+
+def test_async_transport_against_fake_robots():
+    port = free_port()
+    ids = [4, 9, 12]
+    ips = ["127.0.0.2", "127.0.0.3", "127.0.0.4"]
+    #-- A prompt robot, a slow one and one that never answers
+    stops = [ucorobot.start_fake_robot(ips[0], port, ids[0]),
+             ucorobot.start_fake_robot(ips[1], port, ids[1], delay=0.02),
+             ucorobot.start_fake_robot(ips[2], port, ids[2], loss=1.0)]
+    ucorobot.initialize_UDP_async(ids, "127.0.0.1", port, ips)
+    try:
+        commands = np.array([[10, -5], [300, 20], [1, 1]])
+        for _ in range(20):
+            ucorobot.transmission_UDP_async(commands)
+            time.sleep(0.005)
+        stats = wait_acks(np.array([20, 20, 0]))
+    finally:
+        ucorobot.UDP_async_close()
+        for stop in stops:
+            stop()
+
+    np.testing.assert_array_equal(stats["sent"], [20, 20, 20])
+    np.testing.assert_array_equal(stats["acked"], [20, 20, 0])
+    np.testing.assert_allclose(stats["loss"], [0.0, 0.0, 1.0])
+    assert 0 < stats["rtt_ms"][0] < stats["rtt_ms"][1]
+    assert stats["rtt_ms"][1] >= 20
+    assert np.isinf(stats["last_heard_s"][2])
+    #-- Encoders integrate the clamped commands the robots received
+    np.testing.assert_array_equal(stats["encoders"][0:2], [[200, -100], [255*20, 400]])
+    np.testing.assert_array_equal(stats["battery_mV"][0:2], [3900, 3900])
+    assert stats["errors"] == 0 and stats["invalid"] == 0
+
+
+
+def test_ascii_send_errors_are_counted(monkeypatch):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.close()
+    monkeypatch.setattr(ucorobot, "sock", sock, raising=False)
+    monkeypatch.setattr(ucorobot, "UDP_IPS", [("127.0.0.1", 9), ("127.0.0.1", 9)], raising=False)
+    monkeypatch.setattr(ucorobot, "UDP_payload", ["", ""], raising=False)
+    monkeypatch.setattr(ucorobot, "UDP_wire", "ascii")
+    monkeypatch.setattr(ucorobot, "tx_policy", None)
+    errors = ucorobot.link_errors
+
+    #-- A closed socket fails every send, the loop still visits each robot
+    ucorobot.transmission_UDP("DIRECT", np.array([[10, 20], [300, -300]]))
+
+    assert ucorobot.link_errors == errors + 2
+    assert ucorobot.UDP_payload == ["/10,20n", "/255,-255n"]
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_policy(monkeypatch, ticks, whole=False, **policy):
+    clock = Clock()
+    monkeypatch.setattr(ucorobot.time, "monotonic", clock)
+    ucorobot.set_tx_policy(**policy)
+    masks = []
+    for dt, commands in ticks:
+        clock.now += dt
+        masks.append(ucorobot.tx_select(np.array(commands, dtype=np.float64), "DIRECT", whole).tolist())
+    stats = ucorobot.tx_stats()
+    ucorobot.clear_tx_policy()
+    return masks, stats
+
+
+def test_tx_select_threshold(monkeypatch):
+    #-- Changes within the threshold are suppressed, commands clip to +-255
+    masks, stats = run_policy(monkeypatch, [(0.01, [[10, 10], [300, 0]]),
+                                            (0.01, [[10.9, 10], [400, 0]]),
+                                            (0.01, [[12, 10], [255, 0]])],
+                              threshold=1.0, keepalive=10.0)
+    assert masks == [[True, True], [False, False], [True, False]]
+    assert stats['sent'].tolist() == [2, 1] and stats['suppressed'].tolist() == [1, 2]
+    assert stats['suppressed_ratio'] == 0.5
+
+
+def test_tx_select_keepalive(monkeypatch):
+    #-- Unchanged commands are repeated once keepalive seconds went by
+    masks, stats = run_policy(monkeypatch, [(0.1, [[5, 5]])] + [(0.2, [[5, 5]])]*5,
+                              threshold=1.0, keepalive=0.5)
+    assert masks == [[True], [False], [False], [True], [False], [False]]
+    assert stats['sent'].tolist() == [2] and stats['suppressed'].tolist() == [4]
+
+
+def test_tx_select_max_rate(monkeypatch):
+    #-- Every tick changes the command, max_rate still spaces the sends
+    masks, stats = run_policy(monkeypatch, [(0.04, [[k*10, 0]]) for k in range(6)],
+                              threshold=1.0, max_rate=10, keepalive=10.0)
+    assert masks == [[True], [False], [False], [True], [False], [False]]
+    assert stats['sent'].tolist() == [2] and stats['suppressed'].tolist() == [4]
+
+
+def test_tx_select_whole_frame(monkeypatch):
+    #-- One robot changing sends the whole swarm frame, no change sends nothing
+    ticks = [(0.01, [[0, 0], [5, 5], [9, 9]]),
+             (0.01, [[0, 0], [5, 5], [20, 9]]),
+             (0.01, [[0, 0], [5, 5], [20, 9]])]
+    masks, stats = run_policy(monkeypatch, ticks, whole=True, threshold=1.0, keepalive=10.0)
+    assert masks == [[True]*3, [True]*3, [False]*3]
+    assert stats['sent'].tolist() == [2, 2, 2] and stats['suppressed'].tolist() == [1, 1, 1]
+
+    masks, stats = run_policy(monkeypatch, ticks, threshold=1.0, keepalive=10.0)
+    assert masks == [[True]*3, [False, False, True], [False]*3]
@@ -1,20 +1,45 @@
 import numpy as np
-import cv2
 import glob
 import argparse
+import importlib
+import hashlib
+import itertools
+import functools
+import json
 import os
 import time
-import cv2.aruco as aruco
 import math
 import sys
 import socket
+import ipaddress
+import struct
 import csv
+import threading
+import multiprocessing
+import queue
+from multiprocessing import shared_memory
+
+class LazyModule:
+    
+    #-- Imports the module on first attribute access and rebinds the module
+    #-- global to it, so control or UDP only processes never load OpenCV
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+    
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+cv2 = LazyModule('cv2', 'cv2')
+aruco = LazyModule('cv2.aruco', 'aruco')
 
 Uco = argparse.ArgumentParser("Uco Robots library parameters")
-subparsers = Uco.add_subparsers(help='Command help for Uco Robots library')
+subparsers = Uco.add_subparsers(dest='command', help='Command help for Uco Robots library')
 
 calib = subparsers.add_parser('calib', help='Calibration method')
-calib.add_argument("-m", "--mode", type=int, help="Calibration mode. 0 --> Get new calibration images. 1 --> Use existing files", default=0, required=False)
+calib.add_argument("-m", "--mode", type=int, help="Calibration mode. 0 --> Get new calibration images. 1 --> Use existing files. 2 --> Camera rate capture of distinct chessboard views", default=0, required=False)
 calib.add_argument("-ms", "--marker_size", type=float, help="Length of one edge (in meters)", default=0.1)
 calib.add_argument("-d", "--dct", type=str, help="Predefined markers dictionaries/sets (default=aruco.DICT_ARUCO_ORIGINAL)", default="aruco.DICT_ARUCO_ORIGINAL")
 calib.add_argument("-bw", "--board_width", type=int, help="Width of checkerboard (default=9)",  default=9)
@@ -23,14 +48,16 @@ calib.add_argument("-c", "--cam", type=int, help="Camera source (default=0)", de
 calib.add_argument("-ac", "--API_cam", type=str, help="Camera capture API (default=None)", default=None)
 calib.add_argument("-wi", "--width", type=int, help="Width of camera resolution (default=640)", default=640)
 calib.add_argument("-he", "--height", type=int, help="Height of camera resolution (default=480)", default=480)
+calib.add_argument("-j", "--jobs", type=int, help="Corner extraction processes, 0 --> serial with preview windows (default=0)", default=0)
 
 pose = subparsers.add_parser('pose', help = 'Get positional parameters')
 pose.add_argument("-g", "--gray", help="OpenCV gray image.", required=False)
-pose.add_argument("-m", "--mode", type=int, help="Pose parameters mode. 0 --> Pixel based pose. 1 --> Real ArUco based mode.", default=0, required=False)
+pose.add_argument("-m", "--mode", type=int, help="Pose parameters mode. 0 --> Pixel based pose. 1 --> Real ArUco based mode. 2 --> Floor homography based mode.", default=0, required=False)
 pose.add_argument("-mt", "--mtx", help="OpenCV camera matrix.", required=False)
 pose.add_argument("-di", "--dist", help="OpenCV distorsion matrix.", required=False)
 pose.add_argument("-r", "--robot_IDS", help="Robot matrix of IDS.", required=False)
 pose.add_argument("-s", "--size_in", type=int, help="Initial number of units")
+pose.add_argument("-st", "--stamp", type=float, help="Capture timestamp (time.monotonic) of the gray image, see get_frame", default=None)
 
 draw = subparsers.add_parser('draw', help = 'Draw real-time robots')
 draw.add_argument("-f", "--frame", help="Camera image frame.")
@@ -52,6 +79,8 @@ UDP_com.add_argument("-ho", "--host", type=str, help="Wi-Fi connection host IP")
 UDP_com.add_argument("-po", "--port", type=int, help="Wi-Fi connection port")
 UDP_com.add_argument("-ip", "--robot_PC_IP", help="List of robots/PC's IP's")
 UDP_com.add_argument("-m", "--mode", type=str, help="Connection Mode")
+UDP_com.add_argument("-g", "--group", type=str, help="Multicast group or broadcast address. Sends every robot command in one datagram (DIRECT binary mode)", default=None)
+UDP_com.add_argument("-w", "--wire", type=str, help="Wire format. ascii --> '/wl,wrn' text frames. binary --> Fixed size struct frames", default="ascii")
 
 UDP_transmission = subparsers.add_parser('UDP_transmission', help = "Transmit and receive data")
 UDP_transmission.add_argument("-m", "--mode", type=str, help="Connection Mode")
@@ -60,15 +89,163 @@ UDP_transmission.add_argument("-da", "--tr_data", help="Pose or angular velociti
 seq_init = subparsers.add_parser('Goal sequence', help = "Goal sequence generation")
 seq_init.add_argument("-si", "--init_goal", help="Initial goal position")
 seq_init.add_argument("-fi", "--goal_file", type=str, help="Goal position file in csv")
+seq_init.add_argument("-it", "--interp", type=str, help="Goal between waypoints. step --> Last waypoint reached. linear --> Linear interpolation. heading --> Linear position, shortest turn angle", default="step")
 
-Uco_args = Uco.parse_args()
-pose_args = pose.parse_args()
-calib_args = calib.parse_args()
-draw_args = draw.parse_args()
-ctrdiff_args = ctrdiff.parse_args()
-UDP_com_args = UDP_com.parse_args()
-UDP_transmission_args = UDP_transmission.parse_args()
-seq_init_args = seq_init.parse_args()
+#-- Function defaults come from the parser defaults only, sys.argv is parsed
+#-- by config() when a command line entry point asks for it
+pose_args = pose.parse_args([])
+calib_args = calib.parse_args([])
+draw_args = draw.parse_args([])
+ctrdiff_args = ctrdiff.parse_args([])
+UDP_com_args = UDP_com.parse_args([])
+UDP_transmission_args = UDP_transmission.parse_args([])
+seq_init_args = seq_init.parse_args([])
+Uco_args = None
+
+def config(argv=None):
+    
+    global Uco_args
+    
+    #-- Command line arguments, parsed once on first request
+    if Uco_args is None or argv is not None:
+        Uco_args = Uco.parse_args(argv)
+    
+    return Uco_args
+
+#-- Per-stage latency instrumentation, off by default (set_profiling). Each
+#-- stage keeps a rolling window of its last durations, percentiles are
+#-- computed when queried so recording a span is O(1). Disabled spans cost a
+#-- global lookup and a branch.
+perf_enabled = False
+perf_window = 4096
+perf_samples = {}
+perf_counters = {}
+perf_log = None
+perf_log_every = 1.0
+perf_last_dump = 0.0
+perf_last_tick = None
+
+class Span:
+    
+    def __init__(self, stage):
+        self.stage = stage
+    
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        perf_record(self.stage, time.perf_counter() - self.t0)
+
+class NoSpan:
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        pass
+
+NO_SPAN = NoSpan()
+
+def set_profiling(flag=True, window=4096, log=None, log_every=1.0):
+    
+    #-- log is a JSON lines file written by loop_tick every log_every seconds
+    globals()['perf_enabled'] = bool(flag)
+    globals()['perf_window'] = int(window)
+    globals()['perf_log'] = log
+    globals()['perf_log_every'] = float(log_every)
+    perf_reset()
+
+def perf_reset():
+    
+    perf_samples.clear()
+    perf_counters.clear()
+    globals()['perf_last_tick'] = None
+
+def span(stage):
+    
+    #-- with span("stage"): ... times the block when profiling is on
+    if perf_enabled:
+        return Span(stage)
+    return NO_SPAN
+
+def timed(stage):
+    
+    #-- Decorator timing every call of a function as one span of stage
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if not perf_enabled:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                perf_record(stage, time.perf_counter() - t0)
+        return inner
+    return wrap
+
+def perf_record(stage, seconds):
+    
+    #-- Ring buffer of the last perf_window durations: [samples, next index, total count]
+    rec = perf_samples.get(stage)
+    if rec is None:
+        rec = perf_samples[stage] = [np.zeros(perf_window), 0, 0]
+    rec[0][rec[1]] = seconds
+    rec[1] = (rec[1] + 1) % perf_window
+    rec[2] += 1
+
+def perf_count(name, n=1):
+    
+    if perf_enabled:
+        perf_counters[name] = perf_counters.get(name, 0) + n
+
+def loop_tick(budget=None):
+    
+    global perf_last_tick, perf_last_dump
+    
+    #-- Call once per control loop iteration. Records the loop period, counts
+    #-- an overrun when it exceeds budget (seconds) and writes the JSON lines
+    #-- log when one is set.
+    if not perf_enabled:
+        return
+    
+    now = time.perf_counter()
+    if perf_last_tick is not None:
+        period = now - perf_last_tick
+        perf_record('loop', period)
+        if budget is not None and period > budget:
+            perf_count('overrun')
+    perf_last_tick = now
+    
+    if perf_log is not None and now - perf_last_dump >= perf_log_every:
+        perf_last_dump = now
+        perf_dump(perf_log)
+
+def perf_stats():
+    
+    #-- {stage: {count, p50, p95, p99, max, mean}} in ms over the rolling
+    #-- window, plus the counters
+    stages = {}
+    for stage, (samples, _, count) in perf_samples.items():
+        x = samples[:min(count, perf_window)]*1e3
+        p50, p95, p99 = np.percentile(x, [50, 95, 99])
+        stages[stage] = {'count': count, 'p50': p50, 'p95': p95, 'p99': p99,
+                         'max': x.max(), 'mean': x.mean()}
+    
+    return {'stages': stages, 'counters': dict(perf_counters)}
+
+def perf_dump(path=None):
+    
+    #-- One JSON line with a wall clock timestamp, appended to path if given
+    stats = perf_stats()
+    stats['time'] = time.time()
+    line = json.dumps(stats, default=float)
+    if path is not None:
+        with open(path, 'a') as f:
+            f.write(line+"\n")
+    
+    return line
 
 def get_images(cam, API_cam, board_width, board_height, width, height):
     
@@ -101,6 +278,118 @@ def get_images(cam, API_cam, board_width, board_height, width, height):
         cv2.waitKey(WAIT_TIME)
     cv2.destroyAllWindows()
     
+def image_writer(jobs):
+    
+    #-- Background JPEG encoding and disk writes for get_images_async
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        cv2.imwrite(job[0], job[1])
+
+def get_images_async(cam, API_cam, board_width, board_height, width, height, check_width=640, min_move=40):
+    
+    #-- Camera rate calibration capture. A frame is kept only if a fast check
+    #-- on a copy downscaled to check_width finds the chessboard and its
+    #-- corners moved on average more than min_move pixels from every frame
+    #-- already kept. Kept frames are written by a background thread.
+    d = os.path.dirname(__file__)
+    p = r'{}/Calibration_Images'.format(d)
+    board_size = (board_width, board_height)
+    flags = cv2.CALIB_CB_FAST_CHECK + cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE
+    
+    print("----- CALIBRATION IMAGE TAKING -----")
+    print(" ")
+    print("- Please use a cheesboard with "+str(board_width)+" width inner corners")
+    print("- Please use a cheesboard with "+str(board_height)+" height inner corners")
+    print("- Please keep moving the chessboard, only new positions are kept")
+    print(" ")
+    
+    image_number = int(input("Please enter the number of images to calibrate:\n"))
+    
+    jobs = queue.Queue(maxsize=16)
+    writer = threading.Thread(target=image_writer, args=(jobs,), daemon=True)
+    writer.start()
+    
+    cap = open_camera(cam, API_cam, width, height)
+    kept = []
+    frames = 0
+    t0 = time.monotonic()
+    
+    while len(kept) < image_number:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames += 1
+        
+        #-- From the delivered frame, the camera may not honour width/height
+        scale = min(1.0, check_width/frame.shape[1])
+        small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        found, corners = cv2.findChessboardCorners(small, board_size, flags=flags)
+        if not found:
+            continue
+        
+        corners = corners.reshape(-1, 2)/scale
+        if any(np.linalg.norm(corners - c, axis=1).mean() < min_move for c in kept):
+            continue
+        
+        jobs.put((os.path.join(p, 'img_{}.jpg'.format(len(kept))), frame))
+        kept.append(corners)
+        print("Image "+str(len(kept))+"/"+str(image_number)+" kept")
+    
+    cap.release()
+    jobs.put(None)
+    writer.join()
+    
+    print(" ")
+    print(str(len(kept))+" images kept from "+str(frames)+" frames in "+str(round(time.monotonic() - t0, 1))+" s")
+
+def chessboard_corners(fname, board_size):
+    
+    #-- Refined chessboard corners of one calibration image, run in the pool
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+    gray = cv2.imread(fname, cv2.IMREAD_GRAYSCALE)
+    ret, corners = cv2.findChessboardCorners(gray, board_size, None)
+    if ret == True:
+        corners = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
+    else:
+        corners = np.empty((0, 1, 2), dtype=np.float32)
+    
+    return corners, np.array(gray.shape[::-1])
+
+def calibration_corners(images, board_size, jobs, p):
+    
+    #-- Corners of every image found across a process pool. Results, also
+    #-- failed detections, are cached in corners_cache.npz keyed by image
+    #-- content hash and board size so only new images are processed.
+    cache_file = os.path.join(p, 'corners_cache.npz')
+    cache = {}
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as f:
+            cache = {k: f[k] for k in f.files}
+    
+    keys = []
+    for fname in images:
+        with open(fname, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        keys.append(digest+'_'+str(board_size[0])+'x'+str(board_size[1]))
+    
+    missing = [(fname, key) for fname, key in zip(images, keys) if key not in cache]
+    print(str(len(images) - len(missing))+" images from cache, "+str(len(missing))+" to process")
+    
+    if missing:
+        with multiprocessing.Pool(jobs) as pool:
+            found = pool.starmap(chessboard_corners, [(fname, board_size) for fname, _ in missing])
+        for (_, key), (corners, size) in zip(missing, found):
+            cache[key] = corners
+            cache[key+'_size'] = size
+        np.savez(cache_file, **cache)
+    
+    results = [cache[key] for key in keys if len(cache[key]) > 0]
+    image_size = tuple(int(v) for v in cache[keys[0]+'_size']) if keys else None
+    
+    return results, image_size
+
 def calibration(mode = calib_args.mode, 
                 marker_size = calib_args.marker_size, 
                 dct = calib_args.dct, 
@@ -109,7 +398,8 @@ def calibration(mode = calib_args.mode,
                 cam = calib_args.cam,
                 API_cam = calib_args.API_cam, 
                 width = calib_args.width, 
-                height = calib_args.height):
+                height = calib_args.height,
+                jobs = calib_args.jobs):
 
     d = os.path.dirname(__file__)
     p = r'{}/Calibration_Images'.format(d)
@@ -117,6 +407,8 @@ def calibration(mode = calib_args.mode,
         os.makedirs(p)
     if int(mode) == 1:
         get_images(cam, API_cam, board_width, board_height, width, height)
+    elif int(mode) == 2:
+        get_images_async(cam, API_cam, board_width, board_height, width, height)
 
     WAIT_TIME = 50
     
@@ -132,23 +424,33 @@ def calibration(mode = calib_args.mode,
     print("----- CALIBRATION PROCESS -----")
     print(" ")
     
-    images = glob.glob('Calibration_Images/*.jpg')
-    for fname in images:
-        img = cv2.imread(fname)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        ret, corners = cv2.findChessboardCorners(gray, (9,6), None)
-        if ret == True:
+    images = sorted(glob.glob(os.path.join(p, '*.jpg')))
+    
+    if int(jobs) > 0:
+        results, image_size = calibration_corners(images, (board_width, board_height), int(jobs), p)
+        for corners2 in results:
             objpoints.append(objp)
-            corners2 = cv2.cornerSubPix(gray,corners, (11, 11), (-1, -1), criteria)
             imgpoints.append(corners2)
-            img = cv2.drawChessboardCorners(img, (9, 6), corners2, ret)
-            cv2.imshow('img', img)
-            
-            cv2.waitKey(WAIT_TIME)
-            
-    cv2.destroyAllWindows()
+        print(str(len(imgpoints))+" of "+str(len(images))+" images with a detected chessboard")
+        
+    else:
+        for fname in images:
+            img = cv2.imread(fname)
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            ret, corners = cv2.findChessboardCorners(gray, (board_width, board_height), None)
+            if ret == True:
+                objpoints.append(objp)
+                corners2 = cv2.cornerSubPix(gray,corners, (11, 11), (-1, -1), criteria)
+                imgpoints.append(corners2)
+                img = cv2.drawChessboardCorners(img, (board_width, board_height), corners2, ret)
+                cv2.imshow('img', img)
+                
+                cv2.waitKey(WAIT_TIME)
+                
+        cv2.destroyAllWindows()
+        image_size = gray.shape[::-1]
     
-    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, gray.shape[::-1],None,None)
+    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, image_size,None,None)
     
     print("Camera Matrix : " , mtx)
     print("Camera Distorsion : " , dist)
@@ -180,14 +482,47 @@ def angle(x_a, x_b, y_a, y_b):
         
     return ang
 
+def marker_poses(corners):
+    
+    #-- Centers and headings (degrees) of every detected marker in one array
+    #-- pass over the stacked corners, same convention as angle()
+    c = np.concatenate(corners).reshape(-1, 4, 2).astype(np.float64)
+    center = c.mean(axis=1)
+    a = (c[:, 0] + c[:, 3])/2
+    b = (c[:, 1] + c[:, 2])/2
+    ang = np.degrees(np.arctan2(-(b[:, 1] - a[:, 1]), b[:, 0] - a[:, 0]))
+    
+    return center, ang
+
+def slot_table(robot_IDS):
+    
+    #-- Marker ID --> robot slot lookup table, -1 for unassigned IDs
+    robot_IDS = np.asarray(robot_IDS, dtype=np.int64).ravel()
+    table = np.full(int(robot_IDS.max()) + 1 if len(robot_IDS) else 1, -1, dtype=np.int64)
+    table[robot_IDS] = np.arange(len(robot_IDS))
+    
+    return table
+
+def marker_slots(ids, table):
+    
+    #-- Robot slots of the detected markers and the marker index feeding each
+    #-- slot (first detection wins when an ID is seen twice)
+    ids = np.asarray(ids, dtype=np.int64).ravel()
+    slot = np.full(len(ids), -1, dtype=np.int64)
+    valid = (ids >= 0) & (ids < len(table))
+    slot[valid] = table[ids[valid]]
+    hit = np.flatnonzero(slot >= 0)
+    slots, first = np.unique(slot[hit], return_index=True)
+    
+    return slots, hit[first]
+
 def assign():
     size_in = 0
     font = cv2.FONT_HERSHEY_DUPLEX
     
     mtx, dist, dct, cam, API_cam, width, height, _ = read_calib()
     
-    aruco_dict  = aruco.getPredefinedDictionary(eval('aruco.'+dct))
-    parameters  = aruco.DetectorParameters_create()
+    aruco_dict, parameters = get_detector(dct)
     
     cap = cv2.VideoCapture(cam, API_cam)
     
@@ -205,36 +540,17 @@ def assign():
             if(size_in <= len(ids)):
                 robot_IDS = sorted(np.squeeze(ids).reshape(len(ids), 1))
                 size_in = len(ids)
+                assign_corners, assign_ids = corners, ids
     
-    robot_POSE = [[0]*3]*size_in
+    robot_POSE = np.zeros((size_in, 3))
     
     print("----- ROBOTS DETECTION REPORT -----")
     
-    for j in range (size_in):
-        
-        IDS = np.squeeze(np.squeeze(np.where(ids==robot_IDS[j]))[0])
-        
-        x_j = ((corners[IDS][-1][0][0]+
-                corners[IDS][-1][1][0]+
-                corners[IDS][-1][2][0]+
-                corners[IDS][-1][3][0])/4)
-        y_j = ((corners[IDS][-1][0][1]+
-                corners[IDS][-1][1][1]+
-                corners[IDS][-1][2][1]+
-                corners[IDS][-1][3][1])/4)
-        
-        x_a = (corners[IDS][-1][0][0]+
-               corners[IDS][-1][3][0])/2
-        x_b = (corners[IDS][-1][1][0]+
-               corners[IDS][-1][2][0])/2
-        y_a = (corners[IDS][-1][0][1]+
-               corners[IDS][-1][3][1])/2
-        y_b = (corners[IDS][-1][1][1]+
-               corners[IDS][-1][2][1])/2
-               
-        ang_j = angle(x_a, x_b, y_a, y_b)
-               
-        robot_POSE[j] = [x_j, y_j, ang_j]
+    if size_in > 0:
+        center, ang = marker_poses(assign_corners)
+        slots, idx = marker_slots(assign_ids, slot_table(robot_IDS))
+        robot_POSE[slots, 0:2] = center[idx]
+        robot_POSE[slots, 2] = ang[idx]
      
     for k in range(size_in):
         cv2.putText(frame, ("ALPHA "+str(k)),
@@ -272,146 +588,891 @@ def assign():
     cv2.destroyAllWindows()
     cap.release()
     
-def read_calib():
-    cv_file = cv2.FileStorage("calib_params.yaml", cv2.FILE_STORAGE_READ)
-    mtx = cv_file.getNode("mtx").mat()
-    dist = cv_file.getNode("dist").mat()
-    dct = cv_file.getNode("dct").string()
-    cam = int(cv_file.getNode("cam").real())
+#-- In-process caches of the YAML configuration files and detector objects
+calib_cache = {}
+detector_cache = {}
+
+def load_cached(path, parse):
+    
+    #-- Fields of a YAML configuration file, memoized in-process and kept in
+    #-- a binary .npz sidecar. Both are invalidated when the YAML file
+    #-- modification time or size changes.
+    st = os.stat(path)
+    key = np.array([st.st_mtime_ns, st.st_size], dtype=np.int64)
+    
+    if path in calib_cache and np.array_equal(calib_cache[path][0], key):
+        return calib_cache[path][1]
+    
+    sidecar = os.path.splitext(path)[0] + '.npz'
+    fields = None
+    if os.path.exists(sidecar):
+        try:
+            with np.load(sidecar) as f:
+                if np.array_equal(f['_source'], key):
+                    fields = {k: f[k] for k in f.files if k != '_source'}
+        except (OSError, ValueError, KeyError):
+            fields = None
+    
+    if fields is None:
+        fields = {k: np.asarray(v) for k, v in parse(path).items()}
+        #-- The sidecar is only an accelerator, a read-only or foreign owned
+        #-- configuration directory still loads from the YAML file
+        tmp = sidecar + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, _source=key, **fields)
+            os.replace(tmp, sidecar)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    
+    calib_cache[path] = (key, fields)
+    
+    return fields
+
+def parse_calib(path):
+    
+    cv_file = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+    fields = {}
+    fields['mtx'] = cv_file.getNode("mtx").mat()
+    fields['dist'] = cv_file.getNode("dist").mat()
+    fields['dct'] = cv_file.getNode("dct").string()
+    fields['cam'] = int(cv_file.getNode("cam").real())
     if cv_file.getNode("API_cam").isString() != True:
-        API_cam = None
+        fields['API_cam'] = ""
     else:
-        API_cam = cv_file.getNode("API_cam").string()
-    width = int(cv_file.getNode("width").real())
-    height = int(cv_file.getNode("height").real())
-    marker_size = cv_file.getNode("marker_size").real()
+        fields['API_cam'] = cv_file.getNode("API_cam").string()
+    fields['width'] = int(cv_file.getNode("width").real())
+    fields['height'] = int(cv_file.getNode("height").real())
+    fields['marker_size'] = cv_file.getNode("marker_size").real()
     cv_file.release()
     
-    return mtx, dist, dct, cam, API_cam, width, height, marker_size
+    return fields
 
-def initialize():   
-    cv_file = cv2.FileStorage("robot_assign.yaml", cv2.FILE_STORAGE_READ)
-    robot_IDS = cv_file.getNode("robot_IDS").mat()
+def parse_assign(path):
+    
+    cv_file = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+    fields = {'robot_IDS': cv_file.getNode("robot_IDS").mat()}
+    cv_file.release()
+    
+    return fields
+
+def read_calib(path="calib_params.yaml"):
+    
+    c = load_cached(path, parse_calib)
+    API_cam = str(c['API_cam']) if str(c['API_cam']) != "" else None
+    
+    return (c['mtx'], c['dist'], str(c['dct']), int(c['cam']), API_cam,
+            int(c['width']), int(c['height']), float(c['marker_size']))
+
+def read_assign(path="robot_assign.yaml"):
+    
+    return load_cached(path, parse_assign)['robot_IDS']
+
+def get_detector(dct):
+    
+    #-- ArUco dictionary and detector parameters, resolved once per process
+    if dct not in detector_cache:
+        name = dct[len('aruco.'):] if dct.startswith('aruco.') else dct
+        detector_cache[dct] = (aruco.getPredefinedDictionary(getattr(aruco, name)),
+                               aruco.DetectorParameters_create())
+    
+    return detector_cache[dct]
+
+def floor_points(pts, H):
+    
+    #-- (K,2) image points --> (K,2) floor points through the homography
+    p = pts @ H[:, 0:2].T + H[:, 2]
+    
+    return p[:, 0:2]/p[:, 2:3]
+
+def floor_poses(corners, H, mtx=None, dist=None):
+    
+    #-- Floor [x, y, yaw(deg)] of every marker. Centers and the two edge
+    #-- midpoints defining the heading go through the homography in one
+    #-- matrix multiply. Corners are undistorted first when mtx/dist are given.
+    if mtx is not None and dist is not None:
+        c = undistort_corners(corners, mtx, dist)
+    else:
+        c = np.concatenate(corners).reshape(-1, 4, 2).astype(np.float64)
+    
+    size_in = len(c)
+    pts = np.concatenate([c.mean(axis=1), (c[:, 0] + c[:, 3])/2, (c[:, 1] + c[:, 2])/2])
+    p = floor_points(pts, H)
+    
+    center = p[:size_in]
+    d = p[2*size_in:] - p[size_in:2*size_in]
+    
+    return np.column_stack([center, np.degrees(np.arctan2(d[:, 1], d[:, 0]))])
+
+def estimate_homography(corners, ids, reference, mtx=None, dist=None):
+    
+    #-- Pixel --> floor homography from reference markers lying on the floor.
+    #-- reference maps marker ID --> floor (x, y) of the marker center; at
+    #-- least 4 of them must be detected.
+    ids = np.asarray(ids).ravel()
+    if mtx is not None and dist is not None:
+        c = undistort_corners(corners, mtx, dist)
+    else:
+        c = np.concatenate(corners).reshape(-1, 4, 2).astype(np.float64)
+    
+    img = []
+    obj = []
+    for m, i in enumerate(ids):
+        if int(i) in reference:
+            img.append(c[m].mean(axis=0))
+            obj.append(reference[int(i)])
+    
+    if len(img) < 4:
+        print("Floor homography needs at least 4 reference markers, "+str(len(img))+" detected")
+        sys.exit(0)
+    
+    H, _ = cv2.findHomography(np.array(img), np.array(obj, dtype=np.float64), 0)
+    
+    return H
+
+def save_homography(H, path="floor_homography.yaml"):
+    
+    cv_file = cv2.FileStorage(path, cv2.FILE_STORAGE_WRITE)
+    cv_file.write("H", H)
+    cv_file.release()
+
+def parse_homography(path):
+    
+    cv_file = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+    fields = {'H': cv_file.getNode("H").mat()}
     cv_file.release()
     
+    return fields
+
+def read_homography(path="floor_homography.yaml"):
+    
+    return load_cached(path, parse_homography)['H']
+
+#-- Per-robot pose record. pixel is [x, y, angle(deg)] (get_pose mode 0),
+#-- metric is [x, y (pixels), x, y, z (meters), roll, pitch, yaw (deg)]
+#-- (get_pose mode 1), floor is [x, y (meters), yaw (deg)] on the floor
+#-- plane (get_pose mode 2), stamp is the time.monotonic() of the last detection
+#-- and valid tells whether the robot was seen in the last update.
+POSE_DTYPE = np.dtype([('pixel', np.float64, 3),
+                       ('metric', np.float64, 8),
+                       ('floor', np.float64, 3),
+                       ('stamp', np.float64),
+                       ('valid', np.bool_)], align=True)
+
+def initialize():   
+    robot_IDS = read_assign()
+    
     size_in = len(robot_IDS)
     mtx, dist, dct, _, _, width, height, marker_size = read_calib()
 
-    globals()['robot_POSE_A'] = [[0]*3]*size_in
-    globals()['robot_POSE_B'] = [[0]*8]*size_in
-    globals()['x_j'] = 0
-    globals()['y_j'] = 0
-    globals()['ang_j'] = 0
-    globals()['x_k'] = 0
-    globals()['y_k'] = 0
-    globals()['z_k'] = 0
-    globals()['x_jk'] = 0
-    globals()['y_jk'] = 0
-    globals()['roll_k'] = 0
-    globals()['pitch_k'] = 0
-    globals()['yaw_k'] = 0
-    globals()['aruco_dict'] = aruco.getPredefinedDictionary(eval('aruco.'+dct))
-    globals()['parameters'] = aruco.DetectorParameters_create()
+    globals()['robot_STORE'] = np.zeros(size_in, dtype=POSE_DTYPE)
+    globals()['robot_POSE_A'] = robot_STORE['pixel']
+    globals()['robot_POSE_B'] = robot_STORE['metric']
+    globals()['robot_POSE_C'] = robot_STORE['floor']
+    globals()['floor_H'] = read_homography() if os.path.exists("floor_homography.yaml") else None
+    globals()['robot_slot'] = slot_table(robot_IDS)
+    globals()['roi_center'] = np.zeros((size_in, 2))
+    globals()['roi_prev'] = np.zeros((size_in, 2))
+    globals()['roi_extent'] = np.zeros(size_in)
+    globals()['roi_valid'] = np.zeros(size_in, dtype=bool)
+    globals()['roi_count'] = 0
+    globals()['roi_last_full'] = 0
+    globals()['robot_rvec'] = np.zeros((size_in, 3))
+    globals()['robot_tvec'] = np.zeros((size_in, 3))
+    globals()['robot_tracked'] = np.zeros(size_in, dtype=bool)
+    globals()['aruco_dict'], globals()['parameters'] = get_detector(dct)
     globals()['marker_size'] = marker_size
     globals()['width'] = width
     globals()['height'] = height
-    globals()['wr'] = [0]*size_in
-    globals()['wl'] = [0]*size_in
-    globals()['ang_vel'] = [[0]*2]*size_in
-    globals()['F'] = [[0]*2]*size_in
+    globals()['wr'] = np.zeros(size_in)
+    globals()['wl'] = np.zeros(size_in)
+    globals()['ang_vel'] = np.zeros((size_in, 2))
+    globals()['F'] = np.zeros((size_in, 2))
     
     return robot_IDS, size_in
     
+def open_camera(cam, API_cam, width, height):
+    
+    if API_cam is None:
+        cap = cv2.VideoCapture(cam)
+    else:
+        cap = cv2.VideoCapture(cam, getattr(cv2, str(API_cam), API_cam))
+    
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    
+    return cap
+
+#-- Capture ring state, set up by initialize_capture
+capture_cap = None
+capture_ring = None
+capture_stamp = None
+capture_seq = None
+capture_latest = -1
+capture_reading = -1
+capture_count = 0
+capture_consumed = 0
+capture_dropped = 0
+capture_cond = None
+capture_running = False
+capture_thread = None
+
+def initialize_capture(buffers=3, cam=None, API_cam=None, width=None, height=None):
+    
+    #-- Background camera capture into a ring of preallocated frames. Only the
+    #-- newest frame is handed out, frames the consumer did not ask for in time
+    #-- are overwritten (dropped) instead of queued.
+    if cam is None:
+        _, _, _, cam, API_cam, width, height, _ = read_calib()
+    
+    if buffers < 3:
+        print("Capture ring needs at least 3 buffers")
+        sys.exit(0)
+    
+    cap = open_camera(cam, API_cam, width, height)
+    ret, frame = cap.read()
+    if not ret:
+        print("Camera source "+str(cam)+" not available")
+        sys.exit(0)
+    
+    globals()['capture_cap'] = cap
+    globals()['capture_ring'] = np.empty((buffers,) + frame.shape, dtype=frame.dtype)
+    globals()['capture_stamp'] = np.zeros(buffers)
+    globals()['capture_seq'] = np.zeros(buffers, dtype=np.int64)
+    globals()['capture_latest'] = -1
+    globals()['capture_reading'] = -1
+    globals()['capture_count'] = 0
+    globals()['capture_consumed'] = 0
+    globals()['capture_dropped'] = 0
+    globals()['capture_cond'] = threading.Condition()
+    globals()['capture_running'] = True
+    globals()['capture_thread'] = threading.Thread(target=capture_loop, name="ucorobot-capture", daemon=True)
+    
+    capture_thread.start()
+
+def capture_loop():
+    
+    global capture_latest
+    global capture_count
+    
+    buffers = len(capture_ring)
+    
+    while capture_running:
+        
+        #-- Write into a slot that is neither the newest frame nor the one the
+        #-- consumer is holding
+        with capture_cond:
+            slot = (capture_latest + 1) % buffers
+            while slot == capture_reading or slot == capture_latest:
+                slot = (slot + 1) % buffers
+        
+        ret, _ = capture_cap.read(capture_ring[slot])
+        stamp = time.monotonic()
+        if not ret:
+            time.sleep(0.001)
+            continue
+        
+        with capture_cond:
+            capture_count += 1
+            capture_stamp[slot] = stamp
+            capture_seq[slot] = capture_count
+            capture_latest = slot
+            capture_cond.notify_all()
+
+@timed('capture_wait')
+def get_frame(timeout=1.0):
+    
+    global capture_reading
+    global capture_consumed
+    global capture_dropped
+    
+    #-- Latest frame, its capture timestamp (time.monotonic) and sequence
+    #-- number. Blocks until a frame newer than the last one returned arrives.
+    #-- The frame stays valid until the next get_frame call.
+    with capture_cond:
+        if not capture_cond.wait_for(lambda: capture_count > capture_consumed, timeout):
+            return None, 0.0, capture_consumed
+        
+        slot = capture_latest
+        capture_reading = slot
+        seq = int(capture_seq[slot])
+        capture_dropped += seq - capture_consumed - 1
+        perf_count('frames_dropped', seq - capture_consumed - 1)
+        capture_consumed = seq
+        
+        return capture_ring[slot], capture_stamp[slot], seq
+
+def capture_close():
+    
+    global capture_running
+    
+    capture_running = False
+    capture_thread.join()
+    capture_cap.release()
+
+#-- Pixel mode poses from undistorted corners (see set_undistort)
+undistort = False
+undistort_cache = {}
+
+def set_undistort(flag=True):
+    
+    global undistort
+    undistort = bool(flag)
+
+def undistort_corners(corners, mtx, dist):
+    
+    #-- All detected corners undistorted in one call, kept in pixel units
+    pts = np.concatenate(corners).reshape(-1, 1, 2).astype(np.float64)
+    
+    return cv2.undistortPoints(pts, mtx, dist, P=mtx).reshape(-1, 4, 2)
+
+def undistort_frame(frame, mtx, dist):
+    
+    #-- Undistorted copy of a frame for display, so overlays drawn from
+    #-- undistorted poses line up. Remap tables are built once per resolution
+    #-- and calibration.
+    h, w = frame.shape[:2]
+    key = (w, h, np.asarray(mtx).tobytes(), np.asarray(dist).tobytes())
+    
+    if key not in undistort_cache:
+        undistort_cache[key] = cv2.initUndistortRectifyMap(mtx, dist, None, mtx, (w, h), cv2.CV_16SC2)
+    map1, map2 = undistort_cache[key]
+    
+    return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+
 def get_pose(gray = pose_args.gray,
              mode = pose_args.mode,
              mtx = pose_args.mtx,
              dist = pose_args.dist,
              robot_IDS = pose_args.robot_IDS,
-             size_in = pose_args.size_in):
+             size_in = pose_args.size_in,
+             stamp = pose_args.stamp):
     
-    global x_j, y_j, ang_j
-    global x_k, y_k, z_k
-    global x_jk, y_jk
-    global roll_k, pitch_k, yaw_k
-    global robot_POSE_A, robot_POSE_B
     global aruco_dict
     global parameters
-    global marker_size
 
-    corners, ids, rejected = aruco.detectMarkers(gray, aruco_dict, parameters=parameters, cameraMatrix=mtx, distCoeff=dist)
+    with span('detect'):
+        corners, ids, rejected = aruco.detectMarkers(gray, aruco_dict, parameters=parameters, cameraMatrix=mtx, distCoeff=dist)
+    
+    return get_pose_markers(corners, ids, mode, mtx, dist, stamp)
+
+@timed('pose')
+def get_pose_markers(corners, ids, mode, mtx, dist, stamp=None):
+    
+    global robot_STORE
+    global robot_POSE_A, robot_POSE_B, robot_POSE_C
+    global marker_size
+    global robot_slot
+    global robot_rvec, robot_tvec, robot_tracked
+    global floor_H
+    
+    #-- Pose update from already detected markers (detectMarkers output or
+    #-- stacked (M,4,2) corners with (M,1) ids), written in place into
+    #-- robot_STORE. stamp defaults to the time of the call.
+    if stamp is None:
+        stamp = time.monotonic()
+    
+    if int(mode) not in (0, 1, 2):
+        print("Pose parameter mode not valid")
+        sys.exit(0)
+    if int(mode) == 2 and floor_H is None:
+        print("Floor homography based mode needs a floor homography")
+        sys.exit(0)
+    
+    robot_STORE['valid'] = False
     
-    if np.all(ids != None):
+    if np.all(ids != None) and len(ids) > 0:
+        
+        if int(mode) == 0 and undistort and mtx is not None and dist is not None:
+            center, ang = marker_poses(undistort_corners(corners, mtx, dist))
+        else:
+            center, ang = marker_poses(corners)
+        slots, idx = marker_slots(ids, robot_slot)
         
         if int(mode) == 1:
-            for k in range (size_in):
-                IDS = np.squeeze(np.squeeze(np.where(ids==robot_IDS[k]))[0])
-                
-                if (type(IDS) == np.int64):
-                    
-                    x_jk = ((corners[IDS][-1][0][0]+
-                            corners[IDS][-1][1][0]+
-                            corners[IDS][-1][2][0]+
-                            corners[IDS][-1][3][0])/4)
-                    y_jk = ((corners[IDS][-1][0][1]+
-                            corners[IDS][-1][1][1]+
-                            corners[IDS][-1][2][1]+
-                            corners[IDS][-1][3][1])/4)
-                    
-                    rvec, tvec ,_ = aruco.estimatePoseSingleMarkers(corners, marker_size, mtx, dist)
-                    x_k = tvec.ravel()[0]
-                    y_k = tvec.ravel()[1]
-                    z_k = tvec.ravel()[2]
-                    roll_k = np.degrees(rvec.ravel()[0])
-                    pitch_k = np.degrees(rvec.ravel()[1])
-                    yaw_k = np.degrees(rvec.ravel()[2])
-                    
-                    robot_POSE_B[k] = [x_jk, y_jk, x_k, y_k, z_k, roll_k, pitch_k, yaw_k]
-                    
-            return robot_POSE_B
-        
-        elif int(mode) == 0:
-            for j in range (size_in):
-                IDS = np.squeeze(np.squeeze(np.where(ids==robot_IDS[j]))[0])
-    
-                if (type(IDS) == np.int64):
-                        
-                    x_j = ((corners[IDS][-1][0][0]+
-                            corners[IDS][-1][1][0]+
-                            corners[IDS][-1][2][0]+
-                            corners[IDS][-1][3][0])/4)
-                    y_j = ((corners[IDS][-1][0][1]+
-                            corners[IDS][-1][1][1]+
-                            corners[IDS][-1][2][1]+
-                            corners[IDS][-1][3][1])/4)
-                    
-                    x_a = (corners[IDS][-1][0][0]+
-                           corners[IDS][-1][3][0])/2
-                    x_b = (corners[IDS][-1][1][0]+
-                           corners[IDS][-1][2][0])/2
-                    y_a = (corners[IDS][-1][0][1]+
-                           corners[IDS][-1][3][1])/2
-                    y_b = (corners[IDS][-1][1][1]+
-                           corners[IDS][-1][2][1])/2
-                           
-                    ang_j = angle(x_a, x_b, y_a, y_b)
-                    
-                    robot_POSE_A[j] = [x_j, y_j, ang_j]
-        
-            return robot_POSE_A
+            slots, idx = marker_extrinsics(corners, slots, idx, mtx, dist, marker_size)
+            
+            robot_POSE_B[slots, 0:2] = center[idx]
+            robot_POSE_B[slots, 2:5] = robot_tvec[slots]
+            robot_POSE_B[slots, 5:8] = np.degrees(robot_rvec[slots])
         
         else:
-             print("Pose parameter mode not valid")
-             sys.exit(0)
+            robot_POSE_A[slots, 0:2] = center[idx]
+            robot_POSE_A[slots, 2] = ang[idx]
+        
+        if int(mode) == 2:
+            robot_POSE_C[slots] = floor_poses(corners, floor_H, mtx, dist)[idx]
         
+        robot_STORE['stamp'][slots] = stamp
+        robot_STORE['valid'][slots] = True
+        
+    elif int(mode) == 1:
+        robot_tracked[:] = False
+    
+    if int(mode) == 1:
+        return robot_POSE_B
+    elif int(mode) == 2:
+        return robot_POSE_C
     else:
-        if int(mode) == 1:
-            return robot_POSE_B
-        elif int(mode) == 0:
-            return robot_POSE_A
+        return robot_POSE_A
+
+#-- ROI tracking state, sized by initialize()
+roi_center = None
+roi_prev = None
+roi_extent = None
+roi_valid = None
+roi_count = 0
+roi_last_full = 0
+
+def detect_roi(gray, pad, mtx, dist):
+    
+    #-- Detection restricted to padded windows around each tracked robot's
+    #-- predicted marker center (constant velocity from the last two centers)
+    pred = 2*roi_center - roi_prev
+    half = 2*roi_extent + pad
+    h, w = gray.shape[:2]
+    
+    all_corners = []
+    all_ids = []
+    for k in np.flatnonzero(roi_valid):
+        x0 = int(max(0, pred[k, 0] - half[k]))
+        y0 = int(max(0, pred[k, 1] - half[k]))
+        x1 = int(min(w, pred[k, 0] + half[k]))
+        y1 = int(min(h, pred[k, 1] + half[k]))
+        if x1 - x0 < 8 or y1 - y0 < 8:
+            continue
+        
+        corners, ids, _ = aruco.detectMarkers(gray[y0:y1, x0:x1], aruco_dict, parameters=parameters, cameraMatrix=mtx, distCoeff=dist)
+        if ids is not None:
+            all_corners.append(np.concatenate(corners).reshape(-1, 4, 2) + np.array([x0, y0], dtype=np.float32))
+            all_ids.append(ids.reshape(-1, 1))
+    
+    if not all_ids:
+        return np.empty((0, 4, 2), dtype=np.float32), None
+    
+    return np.concatenate(all_corners), np.concatenate(all_ids)
+
+def roi_update(corners, ids):
+    
+    #-- Track raw marker centers and sizes for the next ROI prediction
+    if ids is None or len(ids) == 0:
+        roi_valid[:] = False
+        return
+    
+    center, _ = marker_poses(corners)
+    slots, idx = marker_slots(ids, robot_slot)
+    c = np.concatenate(corners).reshape(-1, 4, 2)[idx]
+    
+    roi_prev[slots] = np.where(roi_valid[slots, np.newaxis], roi_center[slots], center[idx])
+    roi_center[slots] = center[idx]
+    roi_extent[slots] = np.sqrt(((c - center[idx, np.newaxis, :])**2).sum(axis=2)).max(axis=1)
+    roi_valid[:] = False
+    roi_valid[slots] = True
+
+def get_pose_roi(gray, mode, mtx, dist, full_every=30, pad=20, stamp=None, retry_every=10):
+    
+    global roi_count
+    global roi_last_full
+    
+    #-- get_pose with ROI tracked detection. A full-frame pass runs every
+    #-- full_every frames and at once when a tracked robot is not found in
+    #-- its ROI. Robots still missing after that pass (out of view) are only
+    #-- searched for every retry_every frames, the others stay ROI tracked.
+    #-- Returns the pose array and the path taken, "roi" or "full".
+    frame = roi_count
+    roi_count += 1
+    
+    path = "roi"
+    if frame % full_every == 0:
+        path = "full"
+    elif not roi_valid.all() and frame - roi_last_full >= retry_every:
+        path = "full"
+        perf_count('roi_retry')
+    
+    if path == "roi":
+        with span('detect_roi'):
+            corners, ids = detect_roi(gray, pad, mtx, dist)
+        found = np.zeros(len(roi_valid), dtype=bool)
+        if ids is not None:
+            found[marker_slots(ids, robot_slot)[0]] = True
+        if (roi_valid & ~found).any():
+            path = "full"
+            perf_count('roi_miss')
+    
+    if path == "full":
+        roi_last_full = frame
+        with span('detect'):
+            corners, ids, _ = aruco.detectMarkers(gray, aruco_dict, parameters=parameters, cameraMatrix=mtx, distCoeff=dist)
+    
+    roi_update(corners, ids)
+    
+    return get_pose_markers(corners, ids, mode, mtx, dist, stamp), path
+
+def marker_extrinsics(corners, slots, idx, mtx, dist, marker_size):
+    
+    global robot_rvec, robot_tvec, robot_tracked
+    
+    #-- One solvePnP per detected robot marker. Robots also seen on the previous
+    #-- frame start from their last rvec/tvec, the rest use the closed form
+    #-- square solver.
+    h = marker_size/2
+    obj = np.array([[-h, h, 0], [h, h, 0], [h, -h, 0], [-h, -h, 0]], dtype=np.float64)
+    
+    seen = np.zeros(len(robot_tracked), dtype=bool)
+    for k, m in zip(slots, idx):
+        img = np.asarray(corners[m], dtype=np.float64).reshape(4, 2)
+        if robot_tracked[k]:
+            rvec = robot_rvec[k].reshape(3, 1).copy()
+            tvec = robot_tvec[k].reshape(3, 1).copy()
+            ret, rvec, tvec = cv2.solvePnP(obj, img, mtx, dist, rvec, tvec, True, cv2.SOLVEPNP_ITERATIVE)
         else:
-            print("Pose parameter mode not valid")
-            sys.exit(0)
+            ret, rvec, tvec = cv2.solvePnP(obj, img, mtx, dist, flags=cv2.SOLVEPNP_IPPE_SQUARE)
+        if ret:
+            robot_rvec[k] = rvec.ravel()
+            robot_tvec[k] = tvec.ravel()
+            seen[k] = True
+    
+    robot_tracked[:] = seen
+    solved = seen[slots]
+    
+    return slots[solved], idx[solved]
 
+#-- Detection pool state, set up by initialize_detection
+detection_shm = None
+detection_frames = None
+detection_tasks = None
+detection_results = None
+detection_free = []
+detection_pending = {}
+detection_seq = 0
+detection_next = 0
+detection_workers = []
+
+def initialize_detection(workers=None, slots=None, shape=None, mtx=None, dist=None, dct=None):
+    
+    #-- Pool of marker detection processes fed through shared memory. Frames
+    #-- are copied once into a shared slot, workers send back compact corner
+    #-- and ID arrays tagged with the frame sequence number.
+    if shape is None or mtx is None or dist is None or dct is None:
+        c_mtx, c_dist, c_dct, _, _, width, height, _ = read_calib()
+        mtx = c_mtx if mtx is None else mtx
+        dist = c_dist if dist is None else dist
+        dct = c_dct if dct is None else dct
+        shape = (height, width) if shape is None else shape
+    
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if slots is None:
+        slots = 2*workers
+    
+    shape = (slots,) + tuple(shape)
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+    
+    globals()['detection_shm'] = shm
+    globals()['detection_frames'] = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    globals()['detection_tasks'] = multiprocessing.Queue()
+    globals()['detection_results'] = multiprocessing.Queue()
+    globals()['detection_free'] = list(range(slots))
+    globals()['detection_pending'] = {}
+    globals()['detection_seq'] = 0
+    globals()['detection_next'] = 0
+    globals()['detection_workers'] = [multiprocessing.Process(target=detection_worker,
+                                                              args=(shm.name, shape, dct, mtx, dist,
+                                                                    detection_tasks, detection_results),
+                                                              daemon=True)
+                                      for _ in range(workers)]
+    
+    for p in detection_workers:
+        p.start()
+
+def detection_worker(shm_name, shape, dct, mtx, dist, tasks, results):
+    
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frames = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    
+    aruco_dict, parameters = get_detector(dct)
+    
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        
+        seq, slot = task
+        corners, ids, _ = aruco.detectMarkers(frames[slot], aruco_dict, parameters=parameters, cameraMatrix=mtx, distCoeff=dist)
+        
+        if ids is None:
+            corners = np.empty((0, 4, 2), dtype=np.float32)
+            ids = np.empty((0, 1), dtype=np.int32)
+        else:
+            corners = np.concatenate(corners).reshape(-1, 4, 2)
+        
+        results.put((seq, slot, corners, ids))
+    
+    del frames
+    shm.close()
+
+def detection_collect(block=True, poll=0.1):
+    
+    #-- Move one worker result into the re-order buffer and free its slot.
+    #-- A blocking wait polls every poll seconds and stops when a worker
+    #-- died, its frame would never come back.
+    while True:
+        try:
+            seq, slot, corners, ids = detection_results.get(block, poll)
+            break
+        except queue.Empty:
+            if not block:
+                return False
+            dead = [p.exitcode for p in detection_workers if not p.is_alive()]
+            if dead:
+                print("Detection worker exited with code "+str(dead[0])+", "+str(len(dead))+" of "+str(len(detection_workers))+" workers down")
+                sys.exit(0)
+    
+    detection_pending[seq] = (corners, ids)
+    detection_free.append(slot)
+    
+    return True
+
+def submit_frame(gray, block=True):
+    
+    global detection_seq
+    
+    #-- Queue a grayscale frame for detection, returns its sequence number or
+    #-- -1 when every slot is busy and block is False (frame dropped)
+    while not detection_free:
+        if not detection_collect(block):
+            return -1
+    
+    slot = detection_free.pop()
+    np.copyto(detection_frames[slot], gray)
+    seq = detection_seq
+    detection_seq += 1
+    detection_tasks.put((seq, slot))
+    
+    return seq
+
+def get_detections(block=True):
+    
+    global detection_next
+    
+    #-- Next detection result in frame order as (seq, corners, ids), or None
+    #-- when nothing is in flight or, with block False, not ready yet
+    while detection_next not in detection_pending:
+        if detection_next >= detection_seq:
+            return None
+        if not detection_collect(block):
+            return None
+    
+    seq = detection_next
+    corners, ids = detection_pending.pop(seq)
+    detection_next += 1
+    
+    return seq, corners, ids
+
+def detection_close():
+    
+    for _ in detection_workers:
+        detection_tasks.put(None)
+    for p in detection_workers:
+        p.join()
+    
+    globals()['detection_frames'] = None
+    detection_shm.close()
+    detection_shm.unlink()
+
+#-- Kalman filter state, set up by initialize_filter
+kf_x = None
+kf_v = None
+kf_P00 = None
+kf_P01 = None
+kf_P11 = None
+kf_stamp = None
+kf_init = None
+kf_q = None
+kf_r = None
+kf_v0 = None
+kf_pose = None
+kf_age = None
+kf_cov = None
+
+def initialize_filter(size_in, q=(400.0, 400.0, 900.0), r=(1.0, 1.0, 4.0), v0=1e4):
+    
+    #-- Constant velocity Kalman filter per robot on [x, y, angle(deg)], one
+    #-- independent position/velocity pair per axis. q is the white
+    #-- acceleration noise density and r the measurement variance per axis.
+    globals()['kf_x'] = np.zeros((size_in, 3))
+    globals()['kf_v'] = np.zeros((size_in, 3))
+    globals()['kf_P00'] = np.zeros((size_in, 3))
+    globals()['kf_P01'] = np.zeros((size_in, 3))
+    globals()['kf_P11'] = np.zeros((size_in, 3))
+    globals()['kf_stamp'] = np.zeros(size_in)
+    globals()['kf_init'] = np.zeros(size_in, dtype=bool)
+    globals()['kf_q'] = np.asarray(q, dtype=np.float64)
+    globals()['kf_r'] = np.asarray(r, dtype=np.float64)
+    globals()['kf_v0'] = v0
+    globals()['kf_pose'] = np.zeros((size_in, 3))
+    globals()['kf_age'] = np.zeros(size_in)
+    globals()['kf_cov'] = np.zeros((size_in, 6, 6))
+
+def wrap_angle(ang):
+    
+    return (ang + 180) % 360 - 180
+
+def filter_update(robot_POSE=None, valid=None, stamp=None):
+    
+    #-- Fuse the robots measured in the last get_pose. Defaults read the pixel
+    #-- pose, validity flags and capture timestamps from robot_STORE.
+    if robot_POSE is None:
+        robot_POSE = robot_STORE['pixel']
+    if valid is None:
+        valid = robot_STORE['valid']
+    if stamp is None:
+        stamp = robot_STORE['stamp']
+    stamp = np.broadcast_to(stamp, valid.shape)
+    
+    #-- First measurement of a robot initializes its state
+    new = valid & ~kf_init
+    if new.any():
+        kf_x[new] = robot_POSE[new]
+        kf_v[new] = 0
+        kf_P00[new] = kf_r
+        kf_P01[new] = 0
+        kf_P11[new] = kf_v0
+        kf_stamp[new] = stamp[new]
+        kf_init[new] = True
+    
+    k = np.flatnonzero(valid & ~new)
+    if len(k) == 0:
+        return
+    
+    #-- Predict to the measurement time
+    dt = np.maximum(stamp[k] - kf_stamp[k], 0)[:, np.newaxis]
+    x = kf_x[k] + kf_v[k]*dt
+    P00 = kf_P00[k] + dt*(2*kf_P01[k] + dt*kf_P11[k]) + kf_q*dt**3/3
+    P01 = kf_P01[k] + dt*kf_P11[k] + kf_q*dt**2/2
+    P11 = kf_P11[k] + kf_q*dt
+    
+    #-- Measurement update
+    y = np.asarray(robot_POSE)[k] - x
+    y[:, 2] = wrap_angle(y[:, 2])
+    S = P00 + kf_r
+    K0 = P00/S
+    K1 = P01/S
+    
+    x += K0*y
+    x[:, 2] = wrap_angle(x[:, 2])
+    kf_x[k] = x
+    kf_v[k] += K1*y
+    kf_P11[k] = P11 - K1*P01
+    kf_P00[k] = (1 - K0)*P00
+    kf_P01[k] = (1 - K0)*P01
+    kf_stamp[k] = stamp[k]
+
+def filter_predict(t=None, lead=0.0):
+    
+    global kf_pose
+    
+    #-- Pose of every robot extrapolated to time t + lead (time.monotonic()
+    #-- clock, lead covers the remaining control and send latency). Returns
+    #-- the (N,3) pose, its age in seconds and the (N,6,6) state covariance
+    #-- over [x, y, angle, vx, vy, vangle]; kf_cov[:, 0:2, 0:2] is the
+    #-- position block. Axes are independent so cross-axis terms stay zero.
+    if t is None:
+        t = time.monotonic()
+    
+    dt = (t + lead) - kf_stamp
+    np.subtract(t, kf_stamp, out=kf_age)
+    kf_age[~kf_init] = np.inf
+    dt = dt[:, np.newaxis]
+    
+    np.multiply(kf_v, dt, out=kf_pose)
+    kf_pose += kf_x
+    kf_pose[:, 2] = wrap_angle(kf_pose[:, 2])
+    axis = np.arange(3)
+    kf_cov[:, axis, axis] = kf_P00 + dt*(2*kf_P01 + dt*kf_P11) + kf_q*dt**3/3
+    kf_cov[:, axis, axis + 3] = kf_P01 + dt*kf_P11 + kf_q*dt**2/2
+    kf_cov[:, axis + 3, axis] = kf_cov[:, axis, axis + 3]
+    kf_cov[:, axis + 3, axis + 3] = kf_P11 + kf_q*dt
+    
+    return kf_pose, kf_age, kf_cov
+
+#-- Headless mode skips every overlay, controllers still return ang_vel
+headless = False
+hud_cache = {}
+
+def set_headless(flag=True):
+    
+    global headless
+    headless = bool(flag)
+
+def hud_legend(frame, row, color, text):
+    
+    #-- Static legend box rendered once per (frame size, row, color, text)
+    #-- and copied into the frame afterwards. row 0 is the bottom box
+    #-- (CONTROLLER PARAMETERS), row 1 the one above it (POSE PARAMETERS).
+    h = frame.shape[0]
+    key = (frame.shape, row, color, text)
+    y1 = h - 15 - 30*row
+    
+    if key not in hud_cache:
+        patch = np.full((31, 286) + frame.shape[2:], 255, dtype=frame.dtype)
+        cv2.rectangle(patch, (5, 5), (45, 25), color, -1)
+        cv2.putText(patch, (text), (55, 20), cv2.FONT_HERSHEY_DUPLEX, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
+        hud_cache[key] = patch
+    
+    #-- Clipped to the frame like the cv2 drawing calls it replaces
+    y0 = y1 - 30
+    ys, ye = max(0, y0), min(h, y1 + 1)
+    xe = min(frame.shape[1], 301)
+    if ye > ys and xe > 15:
+        frame[ys:ye, 15:xe] = hud_cache[key][ys - y0:ye - y0, 0:xe - 15]
+
+def circle_polys(centers, radius):
+    
+    #-- Circles as closed polygons so a whole swarm goes in one polylines call
+    key = ('circle', radius)
+    if key not in hud_cache:
+        hud_cache[key] = cv2.ellipse2Poly((0, 0), (radius, radius), 0, 0, 360, 5)
+    
+    return list(np.rint(centers[:, np.newaxis, :]).astype(np.int32) + hud_cache[key])
+
+def cross_segments(centers, r_in, r_out):
+    
+    #-- Four crosshair ticks per center as (4N, 2, 2) segments
+    d = np.array([[1, 0], [-1, 0], [0, 1], [0, -1]], dtype=np.float64)
+    seg = np.stack([centers[:, np.newaxis, :] + r_in*d, centers[:, np.newaxis, :] + r_out*d], axis=2)
+    
+    return list(seg.reshape(-1, 2, 2).astype(np.int32))
+
+def heading_segments(centers, ang):
+    
+    #-- Heading tick (30 --> 60) and two side ticks (30 --> 50) per robot
+    c = np.cos(np.radians(ang))[:, np.newaxis]
+    s = np.sin(np.radians(ang))[:, np.newaxis]
+    f = np.concatenate([c, -s], axis=1)
+    n = np.concatenate([-s, -c], axis=1)
+    seg = np.stack([np.stack([centers + 30*f, centers + 60*f], axis=1),
+                    np.stack([centers + 30*n, centers + 50*n], axis=1),
+                    np.stack([centers - 30*n, centers - 50*n], axis=1)], axis=1)
+    
+    return list(seg.reshape(-1, 2, 2).astype(np.int32))
+
+def arrow_segments(p1, p2, tip=0.1):
+    
+    #-- Same geometry as cv2.arrowedLine, three segments per arrow
+    d = p1 - p2
+    size = np.hypot(d[:, 0], d[:, 1])*tip
+    a = np.arctan2(d[:, 1], d[:, 0])
+    h1 = p2 + size[:, np.newaxis]*np.stack([np.cos(a + math.pi/4), np.sin(a + math.pi/4)], axis=1)
+    h2 = p2 + size[:, np.newaxis]*np.stack([np.cos(a - math.pi/4), np.sin(a - math.pi/4)], axis=1)
+    seg = np.stack([np.stack([p1, p2], axis=1), np.stack([p2, h1], axis=1), np.stack([p2, h2], axis=1)], axis=1)
+    
+    return list(np.rint(seg.reshape(-1, 2, 2)).astype(np.int32))
+
+@timed('draw')
 def draw_robots(frame = draw_args.frame,
                 robot_POSE = draw_args.robot_POSE,
                 robot_IDS = draw_args.robot_IDS,
@@ -420,160 +1481,73 @@ def draw_robots(frame = draw_args.frame,
     global width
     global height
     
+    if headless or frame is None:
+        return
+    
     font = cv2.FONT_HERSHEY_DUPLEX
     size_in = len(robot_IDS)
+    robot_POSE = np.asarray(robot_POSE, dtype=np.float64).reshape(size_in, -1)
+    centers = robot_POSE[:, 0:2]
     
-    if len(robot_POSE[0]) == 3:
+    if mode == 0:
         
-        if mode == 0:
-            
-            color = (0, 255, 0)
-            
-            for k in range(size_in):
-                
-                cv2.line(frame, (int(robot_POSE[k][0]+30), int(robot_POSE[k][1])),
-                        (int(robot_POSE[k][0]+50), int(robot_POSE[k][1])), color, 1)
-                cv2.line(frame, (int(robot_POSE[k][0]-30), int(robot_POSE[k][1])),
-                        (int(robot_POSE[k][0]-50), int(robot_POSE[k][1])), color, 1)
-                cv2.line(frame, (int(robot_POSE[k][0]), int(robot_POSE[k][1]+30)),
-                        (int(robot_POSE[k][0]), int(robot_POSE[k][1]+50)), color, 1)
-                cv2.line(frame, (int(robot_POSE[k][0]), int(robot_POSE[k][1]-30)),
-                        (int(robot_POSE[k][0]), int(robot_POSE[k][1]-50)), color, 1)
-                
-                cv2.putText(frame, ("ROBOT: Alpha "+str(k)),
-                           (int(robot_POSE[k][0]) + 20, int(robot_POSE[k][1]) - 60),
-                           font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ("POSITION: (" + str(robot_POSE[k][0]) + ", " + str(robot_POSE[k][1]) + ")"),
-                           (int(robot_POSE[k][0])+20, int(robot_POSE[k][1]) - 40),
-                           font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ("ANGLE: " + str(robot_POSE[k][2]) + " (degrees)"),
-                           (int(robot_POSE[k][0]) + 20, int(robot_POSE[k][1]) - 20),
-                           font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.circle(frame,(int(robot_POSE[k][0]), int(robot_POSE[k][1])), 25, color, 4)
-                cv2.circle(frame,(int(robot_POSE[k][0]), int(robot_POSE[k][1])), 10, color, 2)
-                
-                cv2.rectangle(frame, (15, height-45), (300, height-75), (255, 255, 255), -1)
-                cv2.rectangle(frame, (20, height-50), (60, height-70), color, -1)
-                cv2.putText(frame, ("POSE PARAMETERS"), (70, height-55), font, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
-                
-        elif mode == 1:
-            
-            color = (0, 255, 255)
-            
-            for k in range(size_in):
-                
-                cv2.putText(frame, ("ROBOT: Alpha "+str(k)),
-                           (20, int((k+1)*20)), font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ("--> X = " + str(robot_POSE[k][0]) + ", Y = " + str(robot_POSE[k][1])),
-                           (170, int((k+1)*20)), font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ("--> Angle = " + str(round(robot_POSE[k][2], 2)) + " [degrees]"),
-                           (440, int((k+1)*20)), font, 0.5, color, 1, cv2.LINE_AA)
-                
-                cv2.circle(frame,(int(robot_POSE[k][0]), int(robot_POSE[k][1])), 10, color, 2)
-                cv2.circle(frame,(int(robot_POSE[k][0]), int(robot_POSE[k][1])), 25, color, 4)
-                
-                p1A = [robot_POSE[k][0]+30*math.cos(math.radians(robot_POSE[k][2])),
-                       robot_POSE[k][1]-30*math.sin(math.radians(robot_POSE[k][2]))]
-                p1B = [robot_POSE[k][0]+60*math.cos(math.radians(robot_POSE[k][2])),
-                       robot_POSE[k][1]-60*math.sin(math.radians(robot_POSE[k][2]))]
-                
-                p2A = [robot_POSE[k][0]-30*math.sin(math.radians(robot_POSE[k][2])),
-                       robot_POSE[k][1]-30*math.cos(math.radians(robot_POSE[k][2]))]
-                p2B = [robot_POSE[k][0]-50*math.sin(math.radians(robot_POSE[k][2])),
-                       robot_POSE[k][1]-50*math.cos(math.radians(robot_POSE[k][2]))]
-                
-                p3A = [robot_POSE[k][0]+30*math.sin(math.radians(robot_POSE[k][2])),
-                       robot_POSE[k][1]+30*math.cos(math.radians(robot_POSE[k][2]))]
-                p3B = [robot_POSE[k][0]+50*math.sin(math.radians(robot_POSE[k][2])),
-                       robot_POSE[k][1]+50*math.cos(math.radians(robot_POSE[k][2]))]
-                
-                cv2.line(frame, (int(p1A[0]), int(p1A[1])), (int(p1B[0]), int(p1B[1])), color, 2)
-                cv2.line(frame, (int(p2A[0]), int(p2A[1])), (int(p2B[0]), int(p2B[1])), color, 2)
-                cv2.line(frame, (int(p3A[0]), int(p3A[1])), (int(p3B[0]), int(p3B[1])), color, 2)
-                
-                cv2.rectangle(frame, (15, height-45), (300, height-75), (255, 255, 255), -1)
-                cv2.rectangle(frame, (20, height-50), (60, height-70), color, -1)
-                cv2.putText(frame, ("POSE PARAMETERS"), (70, height-55), font, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
-                
-        else:
-            print("Drawn parameter mode not valid")
-            sys.exit(0)
+        color = (0, 255, 0)
+        
+        cv2.polylines(frame, cross_segments(centers, 30, 50), False, color, 1)
+        cv2.polylines(frame, circle_polys(centers, 25), True, color, 4)
+        cv2.polylines(frame, circle_polys(centers, 10), True, color, 2)
+        
+        for k in range(size_in):
             
-    else:
-        if mode == 0:
+            x = int(robot_POSE[k][0])
+            y = int(robot_POSE[k][1])
             
-            color = (0, 255, 0)
+            if robot_POSE.shape[1] == 3:
+                position = "POSITION: (" + str(robot_POSE[k][0]) + ", " + str(robot_POSE[k][1]) + ")"
+                angle = "ANGLE: " + str(robot_POSE[k][2]) + " (degrees)"
+            else:
+                position = "POSITION: (" + str(round(robot_POSE[k][2],2)) + ", " + str(round(robot_POSE[k][3],2)) + ", " + str(round(robot_POSE[k][4],2)) + ") [meters]"
+                angle = "ANGLE: " + str(round(robot_POSE[k][6],2)) + ", " + str(round(robot_POSE[k][7],2)) + ", " + str(round(robot_POSE[k][5],2)) + " (deg)"
             
-            for k in range(size_in):
-                
-                cv2.line(frame, (int(robot_POSE[k][0]+30), int(robot_POSE[k][1])),
-                        (int(robot_POSE[k][0]+50), int(robot_POSE[k][1])), color, 1)
-                cv2.line(frame, (int(robot_POSE[k][0]-30), int(robot_POSE[k][1])),
-                        (int(robot_POSE[k][0]-50), int(robot_POSE[k][1])), color, 1)
-                cv2.line(frame, (int(robot_POSE[k][0]), int(robot_POSE[k][1]+30)),
-                        (int(robot_POSE[k][0]), int(robot_POSE[k][1]+50)), color, 1)
-                cv2.line(frame, (int(robot_POSE[k][0]), int(robot_POSE[k][1]-30)),
-                        (int(robot_POSE[k][0]), int(robot_POSE[k][1]-50)), color, 1)
-                
-                cv2.putText(frame, ("ROBOT: Alpha "+str(k)),
-                           (int(robot_POSE[k][0]) + 20, int(robot_POSE[k][1]) - 60),
-                           font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ("POSITION: (" + str(round(robot_POSE[k][2],2)) + ", " + str(round(robot_POSE[k][3],2)) + ", " + str(round(robot_POSE[k][4],2)) + ") [meters]"),
-                           (int(robot_POSE[k][0])+20, int(robot_POSE[k][1]) - 40),
-                           font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ("ANGLE: " + str(round(robot_POSE[k][6],2)) + ", " + str(round(robot_POSE[k][7],2)) + ", " + str(round(robot_POSE[k][5],2)) + " (deg)"),
-                           (int(robot_POSE[k][0]) + 20, int(robot_POSE[k][1]) - 20),
-                           font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.circle(frame,(int(robot_POSE[k][0]), int(robot_POSE[k][1])), 25, color, 4)
-                cv2.circle(frame,(int(robot_POSE[k][0]), int(robot_POSE[k][1])), 10, color, 2)
-                
-                cv2.rectangle(frame, (15, height-45), (300, height-75), (255, 255, 255), -1)
-                cv2.rectangle(frame, (20, height-50), (60, height-70), color, -1)
-                cv2.putText(frame, ("POSE PARAMETERS"), (70, height-55), font, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
+            cv2.putText(frame, ("ROBOT: Alpha "+str(k)), (x + 20, y - 60), font, 0.5, color, 1, cv2.LINE_AA)
+            cv2.putText(frame, (position), (x + 20, y - 40), font, 0.5, color, 1, cv2.LINE_AA)
+            cv2.putText(frame, (angle), (x + 20, y - 20), font, 0.5, color, 1, cv2.LINE_AA)
+        
+    elif mode == 1:
+        
+        color = (0, 255, 255)
         
-        elif mode == 1:
+        if robot_POSE.shape[1] == 3:
+            ang = robot_POSE[:, 2]
+        else:
+            ang = robot_POSE[:, 5] + 180
+        
+        cv2.polylines(frame, circle_polys(centers, 10), True, color, 2)
+        cv2.polylines(frame, circle_polys(centers, 25), True, color, 4)
+        cv2.polylines(frame, heading_segments(centers, ang), False, color, 2)
+        
+        for k in range(size_in):
             
-            color = (0, 255, 255)
+            if robot_POSE.shape[1] == 3:
+                position = "--> X = " + str(robot_POSE[k][0]) + ", Y = " + str(robot_POSE[k][1])
+                angle = "--> Angle = " + str(round(robot_POSE[k][2], 2)) + " [degrees]"
+                x_angle = 440
+            else:
+                position = "--> X = " + str(round(robot_POSE[k][2],2)) + ", Y = " + str(round(robot_POSE[k][3],2)) + ", Z = " + str(round(robot_POSE[k][4],2))+ " [meters]"
+                angle = "--> Roll = " + str(round(robot_POSE[k][6],2)) + ", Pitch = " + str(round(robot_POSE[k][7],2)) + ", Yaw = " + str(round(robot_POSE[k][5],2))+ " [deg]"
+                x_angle = 560
             
-            for k in range(size_in):
-                
-                cv2.putText(frame, ("ROBOT: Alpha "+str(k)),
-                           (20, int((k+1)*20)), font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ("--> X = " + str(round(robot_POSE[k][2],2)) + ", Y = " + str(round(robot_POSE[k][3],2)) + ", Z = " + str(round(robot_POSE[k][4],2))+ " [meters]"),
-                           (170, int((k+1)*20)), font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ("--> Roll = " + str(round(robot_POSE[k][6],2)) + ", Pitch = " + str(round(robot_POSE[k][7],2)) + ", Yaw = " + str(round(robot_POSE[k][5],2))+ " [deg]"),
-                           (560, int((k+1)*20)), font, 0.5, color, 1, cv2.LINE_AA)
-                
-                cv2.circle(frame,(int(robot_POSE[k][0]), int(robot_POSE[k][1])), 10, color, 2)
-                cv2.circle(frame,(int(robot_POSE[k][0]), int(robot_POSE[k][1])), 25, color, 4)
-                
-                p1A = [robot_POSE[k][0]-30*math.cos(math.radians(robot_POSE[k][5])),
-                       robot_POSE[k][1]+30*math.sin(math.radians(robot_POSE[k][5]))]
-                p1B = [robot_POSE[k][0]-60*math.cos(math.radians(robot_POSE[k][5])),
-                       robot_POSE[k][1]+60*math.sin(math.radians(robot_POSE[k][5]))]
-                
-                p2A = [robot_POSE[k][0]+30*math.sin(math.radians(robot_POSE[k][5])),
-                       robot_POSE[k][1]+30*math.cos(math.radians(robot_POSE[k][5]))]
-                p2B = [robot_POSE[k][0]+50*math.sin(math.radians(robot_POSE[k][5])),
-                       robot_POSE[k][1]+50*math.cos(math.radians(robot_POSE[k][5]))]
-                
-                p3A = [robot_POSE[k][0]-30*math.sin(math.radians(robot_POSE[k][5])),
-                       robot_POSE[k][1]-30*math.cos(math.radians(robot_POSE[k][5]))]
-                p3B = [robot_POSE[k][0]-50*math.sin(math.radians(robot_POSE[k][5])),
-                       robot_POSE[k][1]-50*math.cos(math.radians(robot_POSE[k][5]))]
-                
-                cv2.line(frame, (int(p1A[0]), int(p1A[1])), (int(p1B[0]), int(p1B[1])), color, 2)
-                cv2.line(frame, (int(p2A[0]), int(p2A[1])), (int(p2B[0]), int(p2B[1])), color, 2)
-                cv2.line(frame, (int(p3A[0]), int(p3A[1])), (int(p3B[0]), int(p3B[1])), color, 2)
-                
-                cv2.rectangle(frame, (15, height-45), (300, height-75), (255, 255, 255), -1)
-                cv2.rectangle(frame, (20, height-50), (60, height-70), color, -1)
-                cv2.putText(frame, ("POSE PARAMETERS"), (70, height-55), font, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
-                
-        else:
-            print("Drawn parameter mode not valid")
-            sys.exit(0)
+            cv2.putText(frame, ("ROBOT: Alpha "+str(k)), (20, int((k+1)*20)), font, 0.5, color, 1, cv2.LINE_AA)
+            cv2.putText(frame, (position), (170, int((k+1)*20)), font, 0.5, color, 1, cv2.LINE_AA)
+            cv2.putText(frame, (angle), (x_angle, int((k+1)*20)), font, 0.5, color, 1, cv2.LINE_AA)
+        
+    else:
+        print("Drawn parameter mode not valid")
+        sys.exit(0)
+    
+    hud_legend(frame, 1, color, "POSE PARAMETERS")
             
+@timed('control')
 def MIMC_VADOC_single(robot_POSE, robot_GOAL, ctr_params):
     
     #-- MIMC-VADOC CONTROLLER--------------------------------------------------
@@ -690,6 +1664,7 @@ def MIMC_VADOC_single(robot_POSE, robot_GOAL, ctr_params):
     
     return wl, wr, F
 
+@timed('control')
 def MIMC_VADOC_multiple(robot_POSE, robot_IDS, robot_GOAL, ctr_params):
     
     global wr
@@ -725,7 +1700,7 @@ def MIMC_VADOC_multiple(robot_POSE, robot_IDS, robot_GOAL, ctr_params):
         d_m = ((x_d - x)**2 + (y_d - y)**2)**(1/2)
         
         #-- Attraction field pre-compensation
-        if d_m < d0 :
+        if d_m < ctr_params[3] :
             d0 = 30
         else:
             d0 = ctr_params[3]
@@ -748,7 +1723,7 @@ def MIMC_VADOC_multiple(robot_POSE, robot_IDS, robot_GOAL, ctr_params):
                 rep = [((kr/(L_obs**3))*((1/L_obs)-(1/L0))*(Rx_d-x)), -((kr/(L_obs**3))*((1/L_obs)-(1/L0))*(Ry_d-y))]
             else:
                 rep = [0, 0]      
-            Fr = Fr + rep
+            Fr = [Fr[0] + rep[0], Fr[1] + rep[1]]
 
         #-- Potential field vector
         F[k] = [Fa[0]-Fr[0], Fa[1]-Fr[1]]
@@ -835,6 +1810,7 @@ def MIMC_VADOC_multiple(robot_POSE, robot_IDS, robot_GOAL, ctr_params):
             
         #----------------------------------------------------------------------
         
+@timed('control')
 def MIMC_VADOC_multiple_2(robot_POSE, robot_IDS, robot_GOAL, ctr_params):
     
     global wr
@@ -870,7 +1846,7 @@ def MIMC_VADOC_multiple_2(robot_POSE, robot_IDS, robot_GOAL, ctr_params):
         d_m = ((x_d - x)**2 + (y_d - y)**2)**(1/2)
         
         #-- Attraction field pre-compensation
-        if d_m < d0 :
+        if d_m < ctr_params[3] :
             d0 = 30
         else:
             d0 = ctr_params[3]
@@ -893,7 +1869,7 @@ def MIMC_VADOC_multiple_2(robot_POSE, robot_IDS, robot_GOAL, ctr_params):
                 rep = [((kr/(L_obs**3))*((1/L_obs)-(1/L0))*(Rx_d-x)), -((kr/(L_obs**3))*((1/L_obs)-(1/L0))*(Ry_d-y))]
             else:
                 rep = [0, 0]      
-            Fr = Fr + rep
+            Fr = [Fr[0] + rep[0], Fr[1] + rep[1]]
 
         #-- Potential field vector
         F[k] = [Fa[0]-Fr[0], Fa[1]-Fr[1]]
@@ -913,8 +1889,6 @@ def MIMC_VADOC_multiple_2(robot_POSE, robot_IDS, robot_GOAL, ctr_params):
         #-- Angle to objetive direction compensation
         #ang_F = math.atan((y_d - y)/(x_d - x))
         ang_F = math.atan2((-(y_d - y)),(x_d - x))
-        print(ang)
-        print(ang_F)
         #F_ang = math.acos((x_d - x)/d_m)
         
         '''
@@ -989,6 +1963,195 @@ def MIMC_VADOC_multiple_2(robot_POSE, robot_IDS, robot_GOAL, ctr_params):
             
         #----------------------------------------------------------------------
     
+@timed('control')
+def MIMC_VADOC_batch(robot_POSE, robot_GOAL, ctr_params, wl_out, wr_out, F_out=None, version=2):
+    
+    #-- MIMC-VADOC CONTROLLER (whole swarm per call)---------------------------
+    #-- robot_POSE and robot_GOAL are (N,3) [x, y, angle(deg)] arrays. wl_out and
+    #-- wr_out are (N,) buffers and F_out an optional (N,2) buffer, all written in
+    #-- place. version selects the heading law of MIMC_VADOC_multiple (1) or
+    #-- MIMC_VADOC_multiple_2 (2).
+    
+    #-- Controller input parameters
+    r = ctr_params[0]
+    l = ctr_params[1]
+    ks = ctr_params[2]
+    d0 = ctr_params[3]
+    kw = ctr_params[4]
+    U_max = ctr_params[5]
+    kr = ctr_params[6]
+    L0 = ctr_params[7]
+    
+    robot_POSE = np.asarray(robot_POSE, dtype=np.float64).reshape(-1, 3)
+    robot_GOAL = np.asarray(robot_GOAL, dtype=np.float64).reshape(-1, 3)
+    
+    x = robot_POSE[:, 0]
+    y = robot_POSE[:, 1]
+    ang = np.radians(robot_POSE[:, 2])
+    ang_d = np.radians(robot_GOAL[:, 2])
+    dx = robot_GOAL[:, 0] - x
+    dy = robot_GOAL[:, 1] - y
+    
+    #-- MIMC MODEL
+    #-- Distance toward objetive
+    d_m = np.hypot(dx, dy)
+    
+    #-- Attraction field pre-compensation
+    d0_k = np.where(d_m < d0, 30.0, d0)
+    near = d_m <= d0_k
+    
+    #-- Attraction field calculations
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Fa_mag = np.where(near, 0.0, ks*(d_m - d0_k)/(d_m**(3/2)))
+    Fx = Fa_mag*dx
+    Fy = -Fa_mag*dy
+    
+    #-- Repulsion field calculations
+    Fr = MIMC_VADOC_repulsion(robot_POSE, kr, L0)
+    
+    #-- Potential field vector
+    Fx -= Fr[:, 0]
+    Fy -= Fr[:, 1]
+    if F_out is not None:
+        F_out[:, 0] = Fx
+        F_out[:, 1] = Fy
+    
+    #-- Linear velocities calculation
+    cos_ang = np.cos(ang)
+    sin_ang = np.sin(ang)
+    o_F = (cos_ang*Fx + sin_ang*Fy)/(1 + np.hypot(Fx, Fy))
+    
+    #-- Final maximum based linear velocity calculation
+    ui = np.where(o_F >= 0, o_F*U_max, 0.0)
+    
+    #-- VADOC MODEL
+    #-- Angle to objetive direction compensation
+    if version == 1:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ang_F = np.arccos(np.clip(dx/d_m, -1, 1))
+        ang_F = np.where(dy >= 0, -ang_F, ang_F)
+    else:
+        ang_F = np.arctan2(-dy, dx)
+    
+    #-- Virtual angle distances toward objetive and final desired angle
+    F_dist = np.hypot(np.cos(ang_F) - cos_ang, np.sin(ang_F) - sin_ang)
+    F_dist_des = np.hypot(np.cos(ang_d) - cos_ang, np.sin(ang_d) - sin_ang)
+    
+    #-- Angular velocities singularities compensations
+    ang_t = np.where(near, ang_d, ang_F)
+    wi = kw*np.where(near, F_dist_des, F_dist)*np.sign(ang - ang_t)
+    if version != 1:
+        flip = ((ang_t > math.pi/2) & (ang < -math.pi/2)) | ((ang > math.pi/2) & (ang_t < -math.pi/2))
+        wi = np.where(flip, -wi, wi)
+    
+    #-- Tranform base velocity parameters to dynamical actuator signals
+    np.divide(ui + (wi*l)/2, r, out=wl_out)
+    np.divide(ui - (wi*l)/2, r, out=wr_out)
+    
+    #--------------------------------------------------------------------------
+    
+    return wl_out, wr_out
+
+def MIMC_VADOC_repulsion(robot_POSE, kr, L0, mode=None):
+    
+    #-- Repulsion field for an (N,3) pose array, returns (N,2). mode "grid" or
+    #-- "pairs" forces the neighbour search, None picks by swarm size.
+    if mode is None:
+        mode = "grid" if len(robot_POSE) >= GRID_MIN_ROBOTS else "pairs"
+    if str(mode) == "grid":
+        return MIMC_VADOC_repulsion_grid(robot_POSE, kr, L0)
+    
+    #-- All-pairs path
+    x = robot_POSE[:, 0]
+    y = robot_POSE[:, 1]
+    Rx = x[np.newaxis, :] - x[:, np.newaxis]
+    Ry = y[np.newaxis, :] - y[:, np.newaxis]
+    L_obs = np.sqrt(1.2*Rx**2 + Ry**2)
+    
+    #-- Only other robots inside the L0 radius contribute
+    mask = (L_obs <= L0) & (L_obs > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c = np.where(mask, (kr/(L_obs**3))*((1/L_obs) - (1/L0)), 0.0)
+    
+    Fr = np.empty((len(x), 2))
+    Fr[:, 0] = (c*Rx).sum(axis=1)
+    Fr[:, 1] = -(c*Ry).sum(axis=1)
+    
+    return Fr
+    
+#-- Swarm size from which MIMC_VADOC_repulsion switches to the grid index
+#-- (crossover measured with ucorobot_bench.py repulsion)
+GRID_MIN_ROBOTS = 80
+grid_order = None
+
+def grid_index(robot_POSE, cell):
+    
+    global grid_order
+    
+    #-- Uniform grid over the current poses with cells of side "cell". Robots
+    #-- are kept sorted by cell key; the previous frame order is reused as the
+    #-- starting permutation so the stable sort runs on almost sorted keys.
+    x = robot_POSE[:, 0]
+    y = robot_POSE[:, 1]
+    cx = np.floor(x/cell).astype(np.int64)
+    cy = np.floor(y/cell).astype(np.int64)
+    cx -= cx.min() - 1
+    cy -= cy.min() - 1
+    ny = int(cy.max()) + 2
+    key = cx*ny + cy
+    
+    if grid_order is None or len(grid_order) != len(key):
+        order = np.arange(len(key))
+    else:
+        order = grid_order
+    order = order[np.argsort(key[order], kind='stable')]
+    grid_order = order
+    
+    return order, key[order], key, ny
+
+def grid_neighbors(robot_POSE, cell):
+    
+    #-- Candidate (i, j) pairs of robots sharing a cell or an adjacent one
+    order, key_sorted, key, ny = grid_index(robot_POSE, cell)
+    size_in = len(key)
+    
+    offsets = np.array([dx*ny + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+    q = (key[:, np.newaxis] + offsets[np.newaxis, :]).ravel()
+    start = np.searchsorted(key_sorted, q, side='left')
+    count = np.searchsorted(key_sorted, q, side='right') - start
+    
+    total = int(count.sum())
+    i = np.repeat(np.repeat(np.arange(size_in), len(offsets)), count)
+    pos = np.arange(total) - np.repeat(np.cumsum(count) - count, count) + np.repeat(start, count)
+    j = order[pos]
+    
+    keep = i != j
+    return i[keep], j[keep]
+
+def MIMC_VADOC_repulsion_grid(robot_POSE, kr, L0):
+    
+    #-- Repulsion field restricted to grid neighbours. L_obs <= L0 implies
+    #-- |dx| < L0 and |dy| <= L0, so cells of side L0 cover every contribution.
+    i, j = grid_neighbors(robot_POSE, L0)
+    size_in = len(robot_POSE)
+    
+    Rx = robot_POSE[j, 0] - robot_POSE[i, 0]
+    Ry = robot_POSE[j, 1] - robot_POSE[i, 1]
+    L_obs = np.sqrt(1.2*Rx**2 + Ry**2)
+    
+    mask = (L_obs <= L0) & (L_obs > 0)
+    i = i[mask]
+    Rx = Rx[mask]
+    Ry = Ry[mask]
+    L_obs = L_obs[mask]
+    c = (kr/(L_obs**3))*((1/L_obs) - (1/L0))
+    
+    Fr = np.empty((size_in, 2))
+    Fr[:, 0] = np.bincount(i, weights=c*Rx, minlength=size_in)
+    Fr[:, 1] = -np.bincount(i, weights=c*Ry, minlength=size_in)
+    
+    return Fr
+
 def trdiff_control_single(frame = ctrdiff_args.frame,
                           robot_POSE = ctrdiff_args.robot_POSE,
                           robot_IDS = ctrdiff_args.robot_IDS,
@@ -999,9 +2162,7 @@ def trdiff_control_single(frame = ctrdiff_args.frame,
     global width
     global height
     
-    font = cv2.FONT_HERSHEY_DUPLEX
     robot_POSE = np.squeeze(robot_POSE)
-    color = (255, 0, 0)
     
     if len(robot_POSE[0]) == 3:
         
@@ -1011,63 +2172,8 @@ def trdiff_control_single(frame = ctrdiff_args.frame,
             
                 wl, wr, F = MIMC_VADOC_single(robot_POSE, robot_GOAL, ctr_params)
                 
-                x = robot_POSE[0]
-                y = robot_POSE[1]
-                x_d = robot_GOAL[0]
-                y_d = robot_GOAL[1]
-                ang_d = math.radians(robot_GOAL[2])
-                
-                cv2.arrowedLine(frame, (int(x), int(y)), (int(x+(0.5*F[0])), int(y+(0.5*-F[1]))), color, 3)
-                cv2.circle(frame, (int(x_d), int(y_d)), 5, color, 1)
-                
-                cv2.putText(frame, ("GOAL COORDINATES"), (int(x_d) + 20, int(y_d) - 40), font, 0.4, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ((str(x_d)) + ", " + str(y_d) + ", " + str(round(math.degrees(ang_d), 2))), (int(x_d)+20, int(y_d) - 20), font, 0.4, color, 1, cv2.LINE_AA)
-                
-                cv2.line(frame, (int(x_d+30), int(y_d)), (int(x_d+50), int(y_d)), color, 1)
-                cv2.line(frame, (int(x_d-30), int(y_d)), (int(x_d-50), int(y_d)), color, 1)
-                cv2.line(frame, (int(x_d), int(y_d+30)), (int(x_d), int(y_d+50)), color, 1)
-                cv2.line(frame, (int(x_d), int(y_d-30)), (int(x_d), int(y_d-50)), color, 1)
-                
-                p1 = [robot_POSE[0]-40*math.sin(math.radians(robot_POSE[2])),
-                      robot_POSE[1]-40*math.cos(math.radians(robot_POSE[2]))]
-                p2 = [robot_POSE[0]+40*math.sin(math.radians(robot_POSE[2])),
-                      robot_POSE[1]+40*math.cos(math.radians(robot_POSE[2]))]
-                
-                if wl <= 0:
-                    p1A = [p1[0]-20*math.cos(math.radians(robot_POSE[2])),
-                           p1[1]+20*math.sin(math.radians(robot_POSE[2]))]
-                    p1B = [p1[0]-60*math.cos(math.radians(robot_POSE[2])),
-                           p1[1]+60*math.sin(math.radians(robot_POSE[2]))]
-                else:
-                    p1A = [p1[0]+20*math.cos(math.radians(robot_POSE[2])),
-                           p1[1]-20*math.sin(math.radians(robot_POSE[2]))]
-                    p1B = [p1[0]+60*math.cos(math.radians(robot_POSE[2])),
-                           p1[1]-60*math.sin(math.radians(robot_POSE[2]))]
-                
-                if wr <= 0:
-                    p2A = [p2[0]-20*math.cos(math.radians(robot_POSE[2])),
-                           p2[1]+20*math.sin(math.radians(robot_POSE[2]))]
-                    p2B = [p2[0]-60*math.cos(math.radians(robot_POSE[2])),
-                           p2[1]+60*math.sin(math.radians(robot_POSE[2]))]
-                else:
-                    p2A = [p2[0]+20*math.cos(math.radians(robot_POSE[2])),
-                           p2[1]-20*math.sin(math.radians(robot_POSE[2]))]
-                    p2B = [p2[0]+60*math.cos(math.radians(robot_POSE[2])),
-                           p2[1]-60*math.sin(math.radians(robot_POSE[2]))]
-                    
-                cv2.arrowedLine(frame, (int(p1A[0]), int(p1A[1])), (int(p1B[0]), int(p1B[1])), color, 2) 
-                cv2.arrowedLine(frame, (int(p2A[0]), int(p2A[1])), (int(p2B[0]), int(p2B[1])), color, 2)
-                
-                cv2.putText(frame, ("Required angular velocities"),
-                           (int(robot_POSE[0]) + 40, int(robot_POSE[1]) + 40),
-                           font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ("wi = " + str(round(wl, 2)) + ", wr = " + str(round(wr, 2))),
-                           (int(robot_POSE[0]) + 40, int(robot_POSE[1]) + 60),
-                           font, 0.5, color, 1, cv2.LINE_AA)
-                
-                cv2.rectangle(frame, (15, height-15), (300, height-45), (255, 255, 255), -1)
-                cv2.rectangle(frame, (20, height-20), (60, height-40), color, -1)
-                cv2.putText(frame, ("CONTROLLER PARAMETERS"), (70, height-25), font, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
+                if not headless and frame is not None:
+                    draw_control(frame, [robot_POSE], [robot_GOAL], [wl], [wr], [F])
                 
                 return [wr, wl]
             
@@ -1087,6 +2193,56 @@ def trdiff_control_single(frame = ctrdiff_args.frame,
         print("Single controllers for differential robots only support pixel based pose estimation")
         sys.exit(0)
         
+@timed('draw')
+def draw_control(frame, robot_POSE, robot_GOAL, wl, wr, F):
+    
+    #-- Controller overlay for the whole swarm: every glyph kind is a single
+    #-- polylines call, only the per-robot text stays in the loop
+    font = cv2.FONT_HERSHEY_DUPLEX
+    color = (255, 0, 0)
+    size_in = len(robot_POSE)
+    robot_POSE = np.asarray(robot_POSE, dtype=np.float64).reshape(size_in, -1)
+    robot_GOAL = np.asarray(robot_GOAL, dtype=np.float64).reshape(size_in, -1)
+    
+    centers = robot_POSE[:, 0:2]
+    goals = robot_GOAL[:, 0:2]
+    c = np.cos(np.radians(robot_POSE[:, 2]))[:, np.newaxis]
+    s = np.sin(np.radians(robot_POSE[:, 2]))[:, np.newaxis]
+    direction = np.concatenate([c, -s], axis=1)
+    side = np.concatenate([s, c], axis=1)
+    
+    #-- Potential field arrow
+    tip = centers + 0.5*np.asarray(F)*np.array([1, -1])
+    cv2.polylines(frame, arrow_segments(centers, tip), False, color, 3)
+    
+    #-- Goal marker
+    cv2.polylines(frame, circle_polys(goals, 5), True, color, 1)
+    cv2.polylines(frame, cross_segments(goals, 30, 50), False, color, 1)
+    
+    #-- Wheel velocity arrows, pointing forward for positive speeds
+    p1 = centers - 40*side
+    p2 = centers + 40*side
+    sgn_l = np.where(np.asarray(wl) <= 0, -1.0, 1.0)[:, np.newaxis]
+    sgn_r = np.where(np.asarray(wr) <= 0, -1.0, 1.0)[:, np.newaxis]
+    start = np.concatenate([p1 + 20*sgn_l*direction, p2 + 20*sgn_r*direction])
+    end = np.concatenate([p1 + 60*sgn_l*direction, p2 + 60*sgn_r*direction])
+    cv2.polylines(frame, arrow_segments(start, end), False, color, 2)
+    
+    for k in range(size_in):
+        
+        x = int(robot_POSE[k][0])
+        y = int(robot_POSE[k][1])
+        x_d = robot_GOAL[k][0]
+        y_d = robot_GOAL[k][1]
+        ang_d = math.radians(robot_GOAL[k][2])
+        
+        cv2.putText(frame, ("GOAL COORDINATES"), (int(x_d) + 20, int(y_d) - 40), font, 0.4, color, 1, cv2.LINE_AA)
+        cv2.putText(frame, ((str(x_d)) + ", " + str(y_d) + ", " + str(round(math.degrees(ang_d), 2))), (int(x_d)+20, int(y_d) - 20), font, 0.4, color, 1, cv2.LINE_AA)
+        cv2.putText(frame, ("Required angular velocities"), (x + 40, y + 40), font, 0.5, color, 1, cv2.LINE_AA)
+        cv2.putText(frame, ("wl = " + str(round(wl[k], 2)) + ", wr = " + str(round(wr[k], 2))), (x + 40, y + 60), font, 0.5, color, 1, cv2.LINE_AA)
+    
+    hud_legend(frame, 0, color, "CONTROLLER PARAMETERS")
+
 def trdiff_control_multiple(frame = ctrdiff_args.frame,
                             robot_POSE = ctrdiff_args.robot_POSE,
                             robot_IDS = ctrdiff_args.robot_IDS,
@@ -1101,78 +2257,18 @@ def trdiff_control_multiple(frame = ctrdiff_args.frame,
     global height
     global ang_vel
     
-    font = cv2.FONT_HERSHEY_DUPLEX
     robot_POSE = np.squeeze(robot_POSE)
-    color = (255, 0, 0)
-    size_in = len(robot_IDS)
         
     if len(robot_POSE[0]) == 3:
         
         if str(ctr_mode) == "MIMC-VADOC":
         
-            MIMC_VADOC_multiple_2(robot_POSE, robot_IDS, robot_GOAL, ctr_params)
-            
-            for k in range(size_in):
-                
-                ang_vel[k] = [wl[k], wr[k]]
+            MIMC_VADOC_batch(robot_POSE, robot_GOAL, ctr_params, wl, wr, F)
+            ang_vel[:, 0] = wl
+            ang_vel[:, 1] = wr
             
-                x = robot_POSE[k][0]
-                y = robot_POSE[k][1]
-                x_d = robot_GOAL[k][0]
-                y_d = robot_GOAL[k][1]
-                ang_d = math.radians(robot_GOAL[k][2])
-                
-                cv2.arrowedLine(frame, (int(x), int(y)), (int(x+(0.5*F[k][0])), int(y+(0.5*-F[k][1]))), color, 3)
-                cv2.circle(frame, (int(x_d), int(y_d)), 5, color, 1)
-                
-                cv2.putText(frame, ("GOAL COORDINATES"), (int(x_d) + 20, int(y_d) - 40), font, 0.4, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ((str(x_d)) + ", " + str(y_d) + ", " + str(round(math.degrees(ang_d), 2))), (int(x_d)+20, int(y_d) - 20), font, 0.4, color, 1, cv2.LINE_AA)
-                
-                cv2.line(frame, (int(x_d+30), int(y_d)), (int(x_d+50), int(y_d)), color, 1)
-                cv2.line(frame, (int(x_d-30), int(y_d)), (int(x_d-50), int(y_d)), color, 1)
-                cv2.line(frame, (int(x_d), int(y_d+30)), (int(x_d), int(y_d+50)), color, 1)
-                cv2.line(frame, (int(x_d), int(y_d-30)), (int(x_d), int(y_d-50)), color, 1)
-                
-                p1 = [robot_POSE[k][0]-40*math.sin(math.radians(robot_POSE[k][2])),
-                      robot_POSE[k][1]-40*math.cos(math.radians(robot_POSE[k][2]))]
-                p2 = [robot_POSE[k][0]+40*math.sin(math.radians(robot_POSE[k][2])),
-                      robot_POSE[k][1]+40*math.cos(math.radians(robot_POSE[k][2]))]
-                
-                if wl[k] <= 0:
-                    p1A = [p1[0]-20*math.cos(math.radians(robot_POSE[k][2])),
-                           p1[1]+20*math.sin(math.radians(robot_POSE[k][2]))]
-                    p1B = [p1[0]-60*math.cos(math.radians(robot_POSE[k][2])),
-                           p1[1]+60*math.sin(math.radians(robot_POSE[k][2]))]
-                else:
-                    p1A = [p1[0]+20*math.cos(math.radians(robot_POSE[k][2])),
-                           p1[1]-20*math.sin(math.radians(robot_POSE[k][2]))]
-                    p1B = [p1[0]+60*math.cos(math.radians(robot_POSE[k][2])),
-                           p1[1]-60*math.sin(math.radians(robot_POSE[k][2]))]
-                
-                if wr[k] <= 0:
-                    p2A = [p2[0]-20*math.cos(math.radians(robot_POSE[k][2])),
-                           p2[1]+20*math.sin(math.radians(robot_POSE[k][2]))]
-                    p2B = [p2[0]-60*math.cos(math.radians(robot_POSE[k][2])),
-                           p2[1]+60*math.sin(math.radians(robot_POSE[k][2]))]
-                else:
-                    p2A = [p2[0]+20*math.cos(math.radians(robot_POSE[k][2])),
-                           p2[1]-20*math.sin(math.radians(robot_POSE[k][2]))]
-                    p2B = [p2[0]+60*math.cos(math.radians(robot_POSE[k][2])),
-                           p2[1]-60*math.sin(math.radians(robot_POSE[k][2]))]
-                    
-                cv2.arrowedLine(frame, (int(p1A[0]), int(p1A[1])), (int(p1B[0]), int(p1B[1])), color, 2) 
-                cv2.arrowedLine(frame, (int(p2A[0]), int(p2A[1])), (int(p2B[0]), int(p2B[1])), color, 2)
-                
-                cv2.putText(frame, ("Required angular velocities"),
-                           (int(robot_POSE[k][0]) + 40, int(robot_POSE[k][1]) + 40),
-                           font, 0.5, color, 1, cv2.LINE_AA)
-                cv2.putText(frame, ("wl = " + str(round(wl[k], 2)) + ", wr = " + str(round(wr[k], 2))),
-                           (int(robot_POSE[k][0]) + 40, int(robot_POSE[k][1]) + 60),
-                           font, 0.5, color, 1, cv2.LINE_AA)
-                
-                cv2.rectangle(frame, (15, height-15), (300, height-45), (255, 255, 255), -1)
-                cv2.rectangle(frame, (20, height-20), (60, height-40), color, -1)
-                cv2.putText(frame, ("CONTROLLER PARAMETERS"), (70, height-25), font, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
+            if not headless and frame is not None:
+                draw_control(frame, robot_POSE, robot_GOAL, wl, wr, F)
                 
             return ang_vel
         
@@ -1187,27 +2283,375 @@ def trdiff_control_multiple(frame = ctrdiff_args.frame,
     else:
         print("Multiple controllers for differential robots only support pixel based pose estimation")
         sys.exit(0)
+
+#-- Differential drive simulator, a camera-free backend for the controllers.
+#-- Integrates every robot at once from the wl/wr wheel velocities (rad/s)
+#-- with r and l from ctr_params. Poses are pixels [x, y, angle(deg)] like
+#-- get_pose mode 0, scale converts meters to pixels. Measured poses are
+#-- delayed by latency seconds rounded to whole dt steps, get Gaussian noise
+#-- (px, deg) and are lost with probability dropout.
+sim_true = None
+sim_history = None
+sim_head = 0
+sim_time = 0.0
+sim_params = None
+sim_rng = None
+
+def initialize_sim(robot_POSE, ctr_params, dt=1/30, scale=500.0, noise=(0.0, 0.0),
+                   latency=0.0, dropout=0.0, w_max=None, seed=None):
+    
+    robot_POSE = np.array(robot_POSE, dtype=np.float64).reshape(-1, 3)
+    size_in = len(robot_POSE)
+    lag = int(round(latency/dt))
+    
+    globals()['sim_true'] = robot_POSE.copy()
+    globals()['sim_history'] = np.repeat(robot_POSE[np.newaxis], lag + 1, axis=0)
+    globals()['sim_head'] = 0
+    globals()['sim_time'] = 0.0
+    globals()['sim_params'] = (float(ctr_params[0]), float(ctr_params[1]), float(dt), float(scale),
+                               np.asarray(noise, dtype=np.float64), lag, float(dropout), w_max)
+    globals()['sim_rng'] = np.random.default_rng(seed)
+    
+    #-- Same pose store and controller buffers as initialize(), so get_pose
+    #-- consumers (filter, controllers, drawing) run unchanged on the simulator
+    globals()['robot_STORE'] = np.zeros(size_in, dtype=POSE_DTYPE)
+    globals()['robot_POSE_A'] = robot_STORE['pixel']
+    globals()['robot_POSE_B'] = robot_STORE['metric']
+    globals()['robot_POSE_C'] = robot_STORE['floor']
+    robot_POSE_A[:] = robot_POSE
+    globals()['robot_slot'] = slot_table(np.arange(size_in))
+    globals()['wr'] = np.zeros(size_in)
+    globals()['wl'] = np.zeros(size_in)
+    globals()['ang_vel'] = np.zeros((size_in, 2))
+    globals()['F'] = np.zeros((size_in, 2))
+    
+    return np.arange(size_in), size_in
+
+def sim_step(wl_in, wr_in):
+    
+    global sim_head, sim_time
+    
+    r, l, dt, scale, _, _, _, w_max = sim_params
+    if w_max is not None:
+        wl_in = np.clip(wl_in, -w_max, w_max)
+        wr_in = np.clip(wr_in, -w_max, w_max)
+    
+    #-- Exact unicycle arc over dt, the image y axis points down
+    v = r*(np.asarray(wl_in) + np.asarray(wr_in))/2*scale
+    w = r*(np.asarray(wr_in) - np.asarray(wl_in))/l
+    ang = np.radians(sim_true[:, 2])
+    ang_next = ang + w*dt
+    turning = np.abs(w) > 1e-9
+    w_safe = np.where(turning, w, 1.0)
+    dx = np.where(turning, v/w_safe*(np.sin(ang_next) - np.sin(ang)), v*dt*np.cos(ang))
+    dy = np.where(turning, -v/w_safe*(np.cos(ang_next) - np.cos(ang)), v*dt*np.sin(ang))
+    
+    sim_true[:, 0] += dx
+    sim_true[:, 1] -= dy
+    sim_true[:, 2] = wrap_angle(np.degrees(ang_next))
+    sim_time += dt
+    
+    sim_head = (sim_head + 1) % len(sim_history)
+    sim_history[sim_head] = sim_true
+
+def sim_get_pose():
+    
+    #-- Measured poses in the get_pose format, stamped with the time they
+    #-- were "captured" (sim_time - lag*dt). Lost robots keep their last pose.
+    _, _, dt, _, noise, lag, dropout, _ = sim_params
+    size_in = len(sim_true)
+    
+    seen = sim_history[(sim_head + 1) % len(sim_history)]
+    valid = sim_rng.random(size_in) >= dropout if dropout > 0 else np.ones(size_in, dtype=bool)
+    meas = seen[valid]
+    if noise.any():
+        meas = meas + sim_rng.normal(0.0, 1.0, meas.shape)*noise[[0, 0, 1]]
+        meas[:, 2] = wrap_angle(meas[:, 2])
+    
+    robot_STORE['valid'] = valid
+    robot_POSE_A[valid] = meas
+    robot_STORE['stamp'][valid] = sim_time - lag*dt
+    
+    return robot_POSE_A
+
+def sim_run(robot_GOAL, ctr_params, steps, version=2):
+    
+    #-- Closed loop MIMC-VADOC run on the simulator. robot_GOAL is an (N,3)
+    #-- array or a function of the simulated time returning one. Returns the
+    #-- true trajectory (steps + 1, N, 3) and the wheel commands (steps, N, 2).
+    size_in = len(sim_true)
+    traj = np.empty((steps + 1, size_in, 3))
+    cmd = np.empty((steps, size_in, 2))
+    traj[0] = sim_true
+    
+    for k in range(steps):
+        goal = robot_GOAL(sim_time) if callable(robot_GOAL) else robot_GOAL
+        MIMC_VADOC_batch(sim_get_pose(), goal, ctr_params, wl, wr, F, version)
+        cmd[k, :, 0] = wl
+        cmd[k, :, 1] = wr
+        sim_step(wl, wr)
+        traj[k + 1] = sim_true
+    
+    return traj, cmd
+
+#-- Controller gain sweeps over the simulator. A scenario is a dict with
+#-- 'start' (N,3) poses, 'goal' (N,3) goals or a (times, (T,N,3) goals)
+#-- sequence, 'duration' (s) and optionally the initialize_sim arguments
+#-- 'dt', 'scale', 'noise', 'latency', 'dropout', 'w_max', 'seed' and the
+#-- goal 'tolerance' (px).
+CTR_PARAM_NAMES = ('r', 'l', 'ks', 'd0', 'kw', 'U_max', 'kr', 'L0')
+#-- Module state rebound by initialize_sim and sim_run
+SWEEP_STATE = ('robot_STORE', 'robot_POSE_A', 'robot_POSE_B', 'robot_POSE_C', 'robot_slot',
+               'wl', 'wr', 'F', 'ang_vel', 'sim_true', 'sim_history', 'sim_head', 'sim_time',
+               'sim_params', 'sim_rng')
+
+def sweep_params(base, grid=None, ranges=None, samples=0, seed=None):
+    
+    #-- (P,8) parameter sets from base ctr_params. grid maps names to lists of
+    #-- values (cartesian product), ranges maps names to (low, high) drawn
+    #-- uniformly for samples random sets. Both can be combined.
+    base = np.asarray(base, dtype=np.float64)
+    sets = []
+    
+    if grid:
+        cols = [CTR_PARAM_NAMES.index(name) for name in grid]
+        for values in itertools.product(*grid.values()):
+            p = base.copy()
+            p[cols] = values
+            sets.append(p)
+    
+    if ranges and samples > 0:
+        rng = np.random.default_rng(seed)
+        p = np.repeat(base[np.newaxis], samples, axis=0)
+        for name, (low, high) in ranges.items():
+            p[:, CTR_PARAM_NAMES.index(name)] = rng.uniform(low, high, samples)
+        sets.extend(p)
+    
+    if not sets:
+        sets.append(base)
+    
+    return np.array(sets)
+
+def sweep_goal(scenario):
+    
+    goal = scenario['goal']
+    if isinstance(goal, tuple):
+        times = np.asarray(goal[0], dtype=np.float64)
+        goals = np.asarray(goal[1], dtype=np.float64)
+        return lambda t: goals[max(np.searchsorted(times, t, side='right') - 1, 0)], goals[-1]
+    
+    return np.asarray(goal, dtype=np.float64), np.asarray(goal, dtype=np.float64)
+
+def sweep_metrics(traj, cmd, final_goal, dt, tolerance):
+    
+    #-- time_to_goal: first time from which every robot stays within tolerance
+    #-- of its final goal (inf if never). min_distance: closest approach of any
+    #-- two robots. effort: mean integral of wl^2 + wr^2 per robot.
+    #-- oscillation: mean sign changes per second of the turn command wr - wl.
+    d = np.hypot(traj[:, :, 0] - final_goal[:, 0], traj[:, :, 1] - final_goal[:, 1])
+    settled = np.logical_and.accumulate((d < tolerance).all(axis=1)[::-1])[::-1]
+    time_to_goal = np.argmax(settled)*dt if settled.any() else np.inf
+    
+    size_in = traj.shape[1]
+    min_distance = np.inf
+    if size_in > 1:
+        iu = np.triu_indices(size_in, 1)
+        for k in range(0, len(traj), 64):
+            xy = traj[k:k + 64, :, 0:2]
+            pair = np.hypot(xy[:, :, np.newaxis, 0] - xy[:, np.newaxis, :, 0],
+                            xy[:, :, np.newaxis, 1] - xy[:, np.newaxis, :, 1])
+            min_distance = min(min_distance, pair[:, iu[0], iu[1]].min())
+    
+    effort = (cmd**2).sum(axis=2).sum(axis=0).mean()*dt
+    turn = np.sign(cmd[:, :, 1] - cmd[:, :, 0])
+    flips = ((turn[1:]*turn[:-1]) < 0).sum(axis=0)
+    oscillation = flips.mean()/(len(cmd)*dt) if len(cmd) > 0 else 0.0
+    
+    return time_to_goal, min_distance, effort, oscillation
+
+def sweep_worker(ctr_params, scenario):
+    
+    #-- One closed loop run, executed in a pool process
+    dt = scenario.get('dt', 1/30)
+    initialize_sim(scenario['start'], ctr_params, dt, scenario.get('scale', 500.0),
+                   scenario.get('noise', (0.0, 0.0)), scenario.get('latency', 0.0),
+                   scenario.get('dropout', 0.0), scenario.get('w_max', None), scenario.get('seed', 0))
+    goal, final_goal = sweep_goal(scenario)
+    traj, cmd = sim_run(goal, ctr_params, int(round(scenario['duration']/dt)), scenario.get('version', 2))
+    
+    return sweep_metrics(traj, cmd, final_goal, dt, scenario.get('tolerance', 50.0))
+
+def sweep(param_sets, scenario, jobs=None):
+    
+    #-- Closed loop metrics of every parameter set across a process pool.
+    #-- jobs=None uses every core, 1 runs in this process: the simulator
+    #-- replaces the pose store, controller buffers and sim_* state, so they
+    #-- are saved and put back once the sweep is done.
+    param_sets = np.atleast_2d(np.asarray(param_sets, dtype=np.float64))
+    tasks = [(p, scenario) for p in param_sets]
+    
+    if jobs == 1:
+        saved = {k: globals()[k] for k in SWEEP_STATE if k in globals()}
+        try:
+            metrics = [sweep_worker(*task) for task in tasks]
+        finally:
+            for k in SWEEP_STATE:
+                if k in saved:
+                    globals()[k] = saved[k]
+                else:
+                    globals().pop(k, None)
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            metrics = pool.starmap(sweep_worker, tasks, chunksize=max(1, len(tasks)//(4*(jobs or os.cpu_count()))))
+    
+    metrics = np.array(metrics, dtype=np.float64).reshape(-1, 4)
+    
+    return {'params': param_sets,
+            'time_to_goal': metrics[:, 0],
+            'min_distance': metrics[:, 1],
+            'effort': metrics[:, 2],
+            'oscillation': metrics[:, 3]}
+    
+
+#-- Binary wire format, little endian, one fixed size frame per robot:
+#-- version, robot ID, sequence number, timestamp (ms since initialize_UDP)
+#-- and the int16 wheel commands (DIRECT/LISTENER) or float32 pose (MASTER).
+#-- Robots keep the last sequence number seen and drop older frames.
+UDP_VERSION = 1
+UDP_VERSION_PC = 2
+UDP_FRAME = struct.Struct('<BHIIhh')
+UDP_FRAME_PC = struct.Struct('<BHII3f')
+UDP_DTYPE = np.dtype([('version', '<u1'), ('id', '<u2'), ('seq', '<u4'), ('stamp', '<u4'),
+                      ('wl', '<i2'), ('wr', '<i2')])
+UDP_DTYPE_PC = np.dtype([('version', '<u1'), ('id', '<u2'), ('seq', '<u4'), ('stamp', '<u4'),
+                         ('pose', '<f4', 3)])
+UDP_wire = 'ascii'
+UDP_seq = 0
+UDP_t0 = 0.0
+UDP_buffer = None
+UDP_frames_out = None
+
+#-- Swarm frame, one datagram for every robot sent to a multicast group or
+#-- broadcast address: header (version, robot count, sequence number,
+#-- timestamp) followed by one (robot ID, wl, wr) slot per robot. Each robot
+#-- picks its own slot by ID.
+UDP_VERSION_SWARM = 3
+UDP_HEADER = struct.Struct('<BHII')
+UDP_SLOT = struct.Struct('<Hhh')
+UDP_DTYPE_HEADER = np.dtype([('version', '<u1'), ('count', '<u2'), ('seq', '<u4'), ('stamp', '<u4')])
+UDP_DTYPE_SLOT = np.dtype([('id', '<u2'), ('wl', '<i2'), ('wr', '<i2')])
+UDP_group = None
+UDP_header_out = None
+
+def UDP_frames(robot_IDS, dtype, version):
+    
+    #-- One preallocated bytearray for all robot frames, a structured array
+    #-- view to fill it in place and per robot memoryviews to send from
+    buf = bytearray(dtype.itemsize*len(robot_IDS))
+    frames = np.frombuffer(buf, dtype=dtype)
+    frames['version'] = version
+    frames['id'] = robot_IDS
+    mv = memoryview(buf)
+    views = [mv[k*dtype.itemsize:(k + 1)*dtype.itemsize] for k in range(len(robot_IDS))]
+    
+    return buf, frames, views
+
+def UDP_swarm_frame(robot_IDS):
+    
+    #-- Header and slots share one preallocated bytearray sent as is
+    buf = bytearray(UDP_DTYPE_HEADER.itemsize + UDP_DTYPE_SLOT.itemsize*len(robot_IDS))
+    header = np.frombuffer(buf, dtype=UDP_DTYPE_HEADER, count=1)
+    slots = np.frombuffer(buf, dtype=UDP_DTYPE_SLOT, offset=UDP_DTYPE_HEADER.itemsize)
+    header['version'] = UDP_VERSION_SWARM
+    header['count'] = len(robot_IDS)
+    slots['id'] = robot_IDS
+    
+    return buf, header, slots
+
+def UDP_pack(tr_data):
+    
+    global UDP_seq
+    
+    #-- Clamp and pack every robot command in one pass into UDP_frames
+    UDP_seq = (UDP_seq + 1) & 0xFFFFFFFF
+    head = UDP_header_out if UDP_group is not None else UDP_frames_out
+    head['seq'] = UDP_seq
+    head['stamp'] = int((time.monotonic() - UDP_t0)*1000) & 0xFFFFFFFF
+    
+    tr_data = np.asarray(tr_data, dtype=np.float64)
+    if 'pose' in UDP_frames_out.dtype.names:
+        UDP_frames_out['pose'] = tr_data[:len(UDP_frames_out), 0:3]
+    else:
+        w = np.trunc(np.clip(tr_data[:len(UDP_frames_out), 0:2], -255, 255))
+        UDP_frames_out['wl'] = w[:, 0]
+        UDP_frames_out['wr'] = w[:, 1]
+
+def unpack_command(data):
+    
+    #-- Robot side decoding of one binary frame -> (version, ID, seq, stamp, values)
+    if data[0] == UDP_VERSION_PC:
+        f = UDP_FRAME_PC.unpack(data)
+        return f[0], f[1], f[2], f[3], f[4:]
+    else:
+        f = UDP_FRAME.unpack(data)
+        return f[0], f[1], f[2], f[3], f[4:]
+
+def unpack_swarm(data, robot_ID):
+    
+    #-- Robot side decoding of a swarm frame -> (seq, stamp, (wl, wr)), None
+    #-- if the frame carries no slot for robot_ID
+    _, count, seq, stamp = UDP_HEADER.unpack_from(data)
+    slots = np.frombuffer(data, dtype=UDP_DTYPE_SLOT, count=count, offset=UDP_HEADER.size)
+    k = np.flatnonzero(slots['id'] == robot_ID)
+    if len(k) == 0:
+        return None
+    
+    return seq, stamp, (int(slots['wl'][k[0]]), int(slots['wr'][k[0]]))
+
+def UDP_socket(host, port, group=None):
+    
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, port))
+    
+    if group is not None:
+        if ipaddress.ip_address(str(group)).is_multicast:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        else:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
     
+    return sock
 
 def initialize_UDP(robot_IDS = UDP_com_args.robot_IDS,
                    host = UDP_com_args.host,
                    port = UDP_com_args.port,
                    robot_PC_IP = UDP_com_args.robot_PC_IP,
-                   mode = UDP_com_args.mode):
+                   mode = UDP_com_args.mode,
+                   wire = UDP_com_args.wire,
+                   group = UDP_com_args.group):
+    
+    if str(wire) not in ('ascii', 'binary'):
+        print("Non-existent UDP wire format command")
+        sys.exit(0)
+    if group is not None and (str(mode) != 'DIRECT' or str(wire) != 'binary'):
+        print("Swarm frames to a multicast group or broadcast address need DIRECT mode and the binary wire format")
+        sys.exit(0)
     
     size_in = len(robot_IDS)
+    globals()['UDP_wire'] = str(wire)
+    globals()['UDP_group'] = None if group is None else (str(group), port)
+    globals()['UDP_seq'] = 0
+    globals()['UDP_t0'] = time.monotonic()
     globals()['UDP_IPS'] = [0]*size_in
     globals()['UDP_payload'] = [0]*size_in
     globals()['PC_IPS'] = [0]
-    globals()['sock'] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    globals()['sock'] = UDP_socket(host, port, group)
     
     global UDP_IPS
     global UDP_payload
     global PC_IPS
     global sock
     
-    sock.bind((host, port))
-    
     if str(mode) == 'DIRECT':
         
         for k in range(size_in):
@@ -1227,6 +2671,9 @@ def initialize_UDP(robot_IDS = UDP_com_args.robot_IDS,
         for k in range(size_in):
             PC_IPS[k] = (robot_PC_IP[k], port)
             UDP_payload_PC[k] = "/0,0,0n"
+        
+        if UDP_wire == 'binary':
+            globals()['UDP_buffer'], globals()['UDP_frames_out'], UDP_payload_PC[:] = UDP_frames(np.arange(size_in), UDP_DTYPE_PC, UDP_VERSION_PC)
             
         print("MASTER UDP mode connection selected")
             
@@ -1245,7 +2692,72 @@ def initialize_UDP(robot_IDS = UDP_com_args.robot_IDS,
     else:
         print("Non-existent UDP connection mode command")
         sys.exit(0)
+    
+    if UDP_group is not None:
+        globals()['UDP_buffer'], globals()['UDP_header_out'], globals()['UDP_frames_out'] = UDP_swarm_frame(np.asarray(robot_IDS).ravel())
+        print("Swarm frames sent to "+str(UDP_group))
+    elif UDP_wire == 'binary' and str(mode) != 'MASTER':
+        globals()['UDP_buffer'], globals()['UDP_frames_out'], UDP_payload[:] = UDP_frames(np.asarray(robot_IDS).ravel(), UDP_DTYPE, UDP_VERSION)
+
+#-- Transmission policy in front of DIRECT and MASTER modes (set_tx_policy).
+#-- A robot's command is only resent when it moved more than the threshold,
+#-- at most max_rate times per second, and at least every keepalive seconds
+#-- so robots can still detect link loss.
+tx_policy = None
+
+def set_tx_policy(threshold=1.0, max_rate=None, keepalive=0.5):
+    
+    globals()['tx_policy'] = (float(threshold), max_rate, float(keepalive))
+    globals()['tx_last'] = None
+
+def clear_tx_policy():
+    
+    globals()['tx_policy'] = None
+
+def tx_select(tr_data, mode, whole=False):
+    
+    global tx_last, tx_time, tx_sent, tx_suppressed
+    
+    #-- Boolean mask of the robots whose command goes out this tick. whole
+    #-- makes the decision frame-level (swarm frames carry every robot): the
+    #-- frame goes out if any robot qualifies and then counts as sent for all.
+    if str(mode) == 'MASTER':
+        data = np.asarray(tr_data, dtype=np.float64)[:, 0:3]
+    else:
+        data = np.trunc(np.clip(np.asarray(tr_data, dtype=np.float64)[:, 0:2], -255, 255))
+    
+    now = time.monotonic()
+    if tx_last is None or tx_last.shape != data.shape:
+        tx_last = np.full(data.shape, np.nan)
+        tx_time = np.full(len(data), -np.inf)
+        tx_sent = np.zeros(len(data), dtype=np.int64)
+        tx_suppressed = np.zeros(len(data), dtype=np.int64)
+    
+    threshold, max_rate, keepalive = tx_policy
+    age = now - tx_time
+    send = ~(np.abs(data - tx_last) <= threshold).all(axis=1) | (age >= keepalive)
+    if max_rate:
+        send &= age >= 1.0/max_rate
+    if whole and send.any():
+        send[:] = True
+    
+    tx_last[send] = data[send]
+    tx_time[send] = now
+    tx_sent += send
+    tx_suppressed += ~send
+    
+    return send
 
+def tx_stats():
+    
+    if tx_policy is None or tx_last is None:
+        return None
+    
+    return {'sent': tx_sent.copy(),
+            'suppressed': tx_suppressed.copy(),
+            'suppressed_ratio': tx_suppressed.sum()/max(tx_sent.sum() + tx_suppressed.sum(), 1)}
+
+@timed('send')
 def transmission_UDP(mode = UDP_transmission_args.mode,
                      tr_data = UDP_transmission_args.tr_data):
     
@@ -1254,8 +2766,46 @@ def transmission_UDP(mode = UDP_transmission_args.mode,
     global UDP_payload_PC
     global PC_IPS
     global sock
+    global link_errors
     
-    if str(mode) == 'DIRECT':
+    send = None
+    if tx_policy is not None and str(mode) in ('DIRECT', 'MASTER'):
+        send = tx_select(tr_data, mode, UDP_group is not None)
+        if not send.any():
+            return
+    
+    if UDP_wire == 'binary':
+        
+        #-- Frames are already bytes-like, packed in place by UDP_pack
+        UDP_pack(tr_data)
+        
+        if UDP_group is not None:
+            #-- One datagram for the whole swarm
+            try:
+                sock.sendto(UDP_buffer, UDP_group)
+            except OSError:
+                link_errors += 1
+                perf_count('send_errors')
+            return
+        
+        if str(mode) == 'MASTER':
+            payload, IPS = UDP_payload_PC, PC_IPS
+        elif str(mode) in ('DIRECT', 'LISTENER'):
+            payload, IPS = UDP_payload, UDP_IPS
+        else:
+            print("Non-existent UDP transmission mode command")
+            sys.exit(0)
+        
+        for k in range(len(payload)):
+            if send is not None and not send[k]:
+                continue
+            try:
+                sock.sendto(payload[k], IPS[k])
+            except OSError:
+                link_errors += 1
+                perf_count('send_errors')
+    
+    elif str(mode) == 'DIRECT':
         
         size_in = len(UDP_payload)
         
@@ -1274,11 +2824,15 @@ def transmission_UDP(mode = UDP_transmission_args.mode,
 
         for k in range(size_in):
             
+            if send is not None and not send[k]:
+                continue
+            
             try:
                 sock.sendto(bytes(UDP_payload[k], "utf-8"), UDP_IPS[k])
                 #print("Message sent to robot IP: "+str(UDP_IPS[k]))
-            except:
-                pass
+            except OSError:
+                link_errors += 1
+                perf_count('send_errors')
      
     elif str(mode) == 'MASTER':
         
@@ -1286,13 +2840,17 @@ def transmission_UDP(mode = UDP_transmission_args.mode,
         
         for k in range(size_in):
             
+            if send is not None and not send[k]:
+                continue
+            
             UDP_payload_PC[k] = '/'+str(round(tr_data[k][0],2))+','+str(round(tr_data[k][1],2))+','+str(round(tr_data[k][2],2))+'n'
             
             try:
                 sock.sendto(bytes(UDP_payload_PC[k], "utf-8"), PC_IPS[k])
                 print("Message sent to PC IP: "+str(PC_IPS[k]))
-            except:
-                pass
+            except OSError:
+                link_errors += 1
+                perf_count('send_errors')
     
     elif str(mode) == 'LISTENER':
         
@@ -1305,10 +2863,11 @@ def transmission_UDP(mode = UDP_transmission_args.mode,
                 UDP_payload[k] = '/'+str(int(tr_data[k][0]))+','+str(int(tr_data[k][1]))+'n'
                 
                 try:
-                    sock.sendto(bytes(UDP_payload[k], "utf-8"), UDP_IPS[k][0])
+                    sock.sendto(bytes(UDP_payload[k], "utf-8"), UDP_IPS[k])
                     print("Message sent to robot IP: "+str(UDP_IPS[k]))
-                except:
-                    pass
+                except OSError:
+                    link_errors += 1
+                    perf_count('send_errors')
         else:
             print("LISTENER mode transmission is only available for one robot connection")
             sys.exit(0)
@@ -1320,63 +2879,331 @@ def transmission_UDP(mode = UDP_transmission_args.mode,
 def UDP_close():
     sock.close()
 
+#-- Robot telemetry/ack frame: version, robot ID, acknowledged command
+#-- sequence number (0 --> telemetry only), robot timestamp (ms), battery
+#-- (mV) and the left/right wheel encoder counts
+UDP_VERSION_TELEMETRY = 4
+UDP_TELEMETRY = struct.Struct('<BHIIHii')
+LINK_WINDOW = 256
+
+#-- Link state, set up by initialize_UDP_async. link_errors also counts the
+#-- failed sends of the synchronous binary transport.
+link_loop = None
+link_thread = None
+link_transport = None
+link_lock = None
+link_slot = {}
+link_sent_at = None
+link_sent = None
+link_acked = None
+link_rtt = None
+link_last_heard = None
+link_robot_stamp = None
+link_battery = None
+link_encoders = None
+link_errors = 0
+link_invalid = 0
+
+class UDPProtocol:
+    
+    #-- asyncio.DatagramProtocol interface, defined here so importing the
+    #-- module does not import asyncio (it is loaded by the async transport)
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def connection_lost(self, exc):
+        pass
+    
+    def pause_writing(self):
+        pass
+    
+    def resume_writing(self):
+        pass
+    
+    def datagram_received(self, data, addr):
+        pass
+    
+    def error_received(self, exc):
+        pass
+
+class LinkProtocol(UDPProtocol):
+    
+    #-- Receive side of the asyncio transport, runs on the link event loop
+    def datagram_received(self, data, addr):
+        link_receive(data, time.monotonic())
+    
+    def error_received(self, exc):
+        global link_errors
+        link_errors += 1
+
+def loop_thread(name):
+    
+    import asyncio
+    
+    #-- Event loop running forever on a daemon thread
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name=name, daemon=True)
+    thread.start()
+    
+    return loop, thread
+
+def initialize_UDP_async(robot_IDS, host, port, robot_PC_IP, group=None):
+    
+    import asyncio
+    
+    #-- Binary DIRECT transport on an asyncio event loop in a background
+    #-- thread. Sends never block the vision/control loop and robot acks and
+    #-- telemetry are received as they arrive.
+    robot_IDS = np.asarray(robot_IDS).ravel()
+    size_in = len(robot_IDS)
+    
+    globals()['UDP_wire'] = 'binary'
+    globals()['UDP_group'] = None if group is None else (str(group), port)
+    globals()['UDP_seq'] = 0
+    globals()['UDP_t0'] = time.monotonic()
+    globals()['UDP_IPS'] = [(robot_PC_IP[k], port) for k in range(size_in)]
+    if group is None:
+        globals()['UDP_buffer'], globals()['UDP_frames_out'], views = UDP_frames(robot_IDS, UDP_DTYPE, UDP_VERSION)
+    else:
+        globals()['UDP_buffer'], globals()['UDP_header_out'], globals()['UDP_frames_out'] = UDP_swarm_frame(robot_IDS)
+    
+    #-- Per robot link statistics, link_sent_at keeps the send time of the
+    #-- last LINK_WINDOW sequence numbers (0 once acknowledged)
+    globals()['link_slot'] = {int(i): k for k, i in enumerate(robot_IDS)}
+    globals()['link_lock'] = threading.Lock()
+    globals()['link_sent_at'] = np.zeros((size_in, LINK_WINDOW))
+    globals()['link_sent'] = np.zeros(size_in, dtype=np.int64)
+    globals()['link_acked'] = np.zeros(size_in, dtype=np.int64)
+    globals()['link_rtt'] = np.zeros(size_in)
+    globals()['link_last_heard'] = np.full(size_in, -np.inf)
+    globals()['link_robot_stamp'] = np.zeros(size_in, dtype=np.int64)
+    globals()['link_battery'] = np.zeros(size_in)
+    globals()['link_encoders'] = np.zeros((size_in, 2), dtype=np.int64)
+    globals()['link_errors'] = 0
+    globals()['link_invalid'] = 0
+    
+    globals()['link_loop'], globals()['link_thread'] = loop_thread("ucorobot-link")
+    endpoint = link_loop.create_datagram_endpoint(LinkProtocol, sock=UDP_socket(host, port, group))
+    globals()['link_transport'], _ = asyncio.run_coroutine_threadsafe(endpoint, link_loop).result()
+    
+    print("Asynchronous UDP transport started on "+str((host, port)))
+
+def link_send(data, send):
+    
+    #-- Runs on the link event loop, data is a snapshot of UDP_buffer
+    if UDP_group is not None:
+        link_transport.sendto(data, UDP_group)
+    else:
+        size = UDP_DTYPE.itemsize
+        for k in np.flatnonzero(send):
+            link_transport.sendto(data[k*size:(k + 1)*size], UDP_IPS[k])
+
+@timed('send')
+def transmission_UDP_async(tr_data):
+    
+    #-- Packs on the calling thread and hands the frames to the event loop,
+    #-- returns immediately. Follows the transmission policy like DIRECT mode.
+    if tx_policy is not None:
+        send = tx_select(tr_data, 'DIRECT', UDP_group is not None)
+        if not send.any():
+            return
+    else:
+        send = np.ones(len(UDP_IPS), dtype=bool)
+    
+    UDP_pack(tr_data)
+    with link_lock:
+        link_sent_at[send, UDP_seq % LINK_WINDOW] = time.monotonic()
+        link_sent[send] += 1
+    
+    link_loop.call_soon_threadsafe(link_send, bytes(UDP_buffer), send)
+
+def link_receive(data, now):
+    
+    global link_invalid
+    
+    if len(data) != UDP_TELEMETRY.size or data[0] != UDP_VERSION_TELEMETRY:
+        link_invalid += 1
+        return
+    
+    _, ID, seq, stamp, battery, enc_l, enc_r = UDP_TELEMETRY.unpack(data)
+    k = link_slot.get(ID)
+    if k is None:
+        link_invalid += 1
+        return
+    
+    with link_lock:
+        link_last_heard[k] = now
+        link_robot_stamp[k] = stamp
+        link_battery[k] = battery
+        link_encoders[k] = enc_l, enc_r
+        
+        #-- Acks of commands still in the window give an RTT sample, smoothed
+        #-- like TCP's SRTT. Duplicated acks find a cleared send time.
+        i = seq % LINK_WINDOW
+        if seq != 0 and ((UDP_seq - seq) & 0xFFFFFFFF) < LINK_WINDOW and link_sent_at[k, i] > 0:
+            rtt = now - link_sent_at[k, i]
+            link_sent_at[k, i] = 0
+            link_acked[k] += 1
+            link_rtt[k] = rtt if link_acked[k] == 1 else link_rtt[k] + 0.125*(rtt - link_rtt[k])
+
+def link_stats():
+    
+    #-- Per robot arrays, loss counts commands still in flight as lost
+    with link_lock:
+        return {'sent': link_sent.copy(),
+                'acked': link_acked.copy(),
+                'loss': 1 - link_acked/np.maximum(link_sent, 1),
+                'rtt_ms': link_rtt*1000,
+                'last_heard_s': time.monotonic() - link_last_heard,
+                'battery_mV': link_battery.copy(),
+                'encoders': link_encoders.copy(),
+                'errors': link_errors,
+                'invalid': link_invalid}
+
+def UDP_async_close():
+    
+    link_loop.call_soon_threadsafe(link_transport.close)
+    link_loop.call_soon_threadsafe(link_loop.stop)
+    link_thread.join()
+    link_loop.close()
+
+class FakeRobot(UDPProtocol):
+    
+    #-- Local stand in for a robot: integrates the wheel commands into encoder
+    #-- counts and answers every command with a telemetry/ack frame after an
+    #-- optional delay, dropping a fraction of them
+    def __init__(self, loop, robot_ID, loss, delay, battery, seed):
+        self.loop = loop
+        self.robot_ID = robot_ID
+        self.loss = loss
+        self.delay = delay
+        self.battery = battery
+        self.rng = np.random.default_rng(seed)
+        self.encoders = [0, 0]
+        self.t0 = time.monotonic()
+    
+    def datagram_received(self, data, addr):
+        if data[0] == UDP_VERSION_SWARM:
+            command = unpack_swarm(data, self.robot_ID)
+            if command is None:
+                return
+            seq, _, (wl, wr) = command
+        else:
+            _, ID, seq, _, (wl, wr) = unpack_command(data)
+            if ID != self.robot_ID:
+                return
+        
+        if self.rng.random() < self.loss:
+            return
+        
+        self.encoders[0] += wl
+        self.encoders[1] += wr
+        reply = UDP_TELEMETRY.pack(UDP_VERSION_TELEMETRY, self.robot_ID, seq,
+                                   int((time.monotonic() - self.t0)*1000) & 0xFFFFFFFF,
+                                   self.battery, self.encoders[0], self.encoders[1])
+        if self.delay > 0:
+            self.loop.call_later(self.delay, self.transport.sendto, reply, addr)
+        else:
+            self.transport.sendto(reply, addr)
+
+def start_fake_robot(host, port, robot_ID, loss=0.0, delay=0.0, battery=3900, seed=None):
+    
+    import asyncio
+    
+    #-- Fake robot on its own event loop thread, returns the function that
+    #-- stops it
+    loop, thread = loop_thread("ucorobot-fake-robot-"+str(robot_ID))
+    endpoint = loop.create_datagram_endpoint(lambda: FakeRobot(loop, int(robot_ID), loss, delay, battery, seed),
+                                             local_addr=(host, port))
+    transport, _ = asyncio.run_coroutine_threadsafe(endpoint, loop).result()
+    
+    def stop():
+        loop.call_soon_threadsafe(transport.close)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    
+    return stop
+
+#-- Compiled goal sequence, set up by initialize_seq
+seq_times = None
+seq_goals = None
+seq_interp = 'step'
+seq_init_goal = None
+seq_goal = None
+start_time = 0.0
+time_count = 0
+
 def initialize_seq(init_goal = seq_init_args.init_goal,
-                   goal_file = seq_init_args.goal_file):
+                   goal_file = seq_init_args.goal_file,
+                   interp = seq_init_args.interp):
+    
+    if str(interp) not in ('step', 'linear', 'heading'):
+        print("Non-existent goal sequence interpolation command")
+        sys.exit(0)
     
     with open(goal_file) as f:
         reader = csv.reader(f)
-        lst = list(reader)
-    
-    globals()['sequence'] = lst
+        lst = [row for row in reader if row]
+    
+    #-- Rows are "h:m:s:ds", x1, y1, ang1, x2, ... compiled once into a sorted
+    #-- time vector (T,) and a goal tensor (T,N,3)
+    times = np.zeros(len(lst))
+    for k, row in enumerate(lst):
+        h, m, s, ds = row[0].split(':')
+        times[k] = float(h) * 3600 + float(m) * 60 + float(s) + float(ds)/10
+    goals = np.array([[float(v) for v in row[1:]] for row in lst]).reshape(len(lst), -1, 3)
+    order = np.argsort(times, kind='stable')
+    
+    globals()['seq_times'] = times[order]
+    globals()['seq_goals'] = goals[order]
+    globals()['seq_interp'] = str(interp)
     globals()['start_time'] = time.time()
-    globals()['prev_time'] = 0
     globals()['time_count'] = 0
-    globals()['seq_goal'] = init_goal
+    globals()['seq_init_goal'] = None if init_goal is None else np.asarray(init_goal, dtype=np.float64).reshape(-1, 3)
+    globals()['seq_goal'] = seq_init_goal
 
+def goal_seq_time(t=None):
     
-def goal_seq_time():
-    
-    global sequence
-    global start_time
-    global prev_time
     global time_count
     global seq_goal
     
-    current_time = time.time() - start_time
-    abs_time = round(round(current_time, 1)-round(prev_time, 1), 1)
-    prev_time = current_time
+    #-- Goal at sequence time t (default: seconds since initialize_seq). The
+    #-- waypoint is found by binary search, so slow frames never skip one.
+    if t is None:
+        t = time.time() - start_time
     
-    if time_count < len(sequence):
+    k = int(np.searchsorted(seq_times, t, side='right')) - 1
+    time_count = k + 1
+    
+    if k < 0:
+        seq_goal = seq_init_goal
+        return seq_goal
+    
+    if seq_interp == 'step' or k + 1 >= len(seq_times):
+        seq_goal = seq_goals[k].copy()
+        return seq_goal
+    
+    alpha = (t - seq_times[k])/(seq_times[k + 1] - seq_times[k])
+    g0 = seq_goals[k]
+    g1 = seq_goals[k + 1]
+    seq_goal = g0 + alpha*(g1 - g0)
+    if seq_interp == 'heading':
+        seq_goal[:, 2] = wrap_angle(g0[:, 2] + alpha*wrap_angle(g1[:, 2] - g0[:, 2]))
     
-        h, m, s, ds = sequence[time_count][0].split(':')
-        time_k = round(float(h) * 3600 + float(m) * 60 + float(s) + float(ds)/10, 1)
-        a = 0
-        b = 3
-        goal_total = []
-
-        
-        if abs_time != 0.0:
-            
-            if round(current_time, 1) == time_k:
-                
-                goal = sequence[time_count]
-                del goal[0]
-                goal = [int(x) for x in goal]
-                
-                number = int(len(goal)/3)
-                
-                for k in range (number):
-                    k1 = goal[a:b]
-                    goal_total.append(k1)
-                    a = a + 3
-                    b = b + 3
-        
-                time_count = time_count + 1
-                seq_goal = goal_total
-                
     return seq_goal
-            
-        
-        
+
+def main(argv=None):
+    
+    args = config(argv)
     
-    
\ No newline at end of file
+    if args.command == 'calib':
+        calibration(args.mode, args.marker_size, args.dct, args.board_width, args.board_height,
+                    args.cam, args.API_cam, args.width, args.height, args.jobs)
+    elif args.command is None:
+        Uco.print_help()
+    else:
+        print("Command "+str(args.command)+" is only available from Python code")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,422 @@
+import numpy as np
+import argparse
+import time
+import sys
+import os
+import json
+import subprocess
+import contextlib
+import tempfile
+import platform
+import socket
+
+import ucorobot
+
+Bench = argparse.ArgumentParser("Uco Robots library benchmarks")
+bench_subparsers = Bench.add_subparsers(dest="bench", help="Benchmark to run")
+
+repulsion = bench_subparsers.add_parser("repulsion", help="All-pairs vs grid repulsion crossover")
+repulsion.add_argument("-n", "--sizes", type=int, nargs="+", help="Swarm sizes", default=[8, 16, 32, 64, 80, 128, 256, 512, 1024])
+repulsion.add_argument("-L", "--L0", type=float, help="Repulsion radius (pixels)", default=80)
+repulsion.add_argument("-a", "--area", type=float, help="Arena area per robot in L0 units (density)", default=9)
+repulsion.add_argument("-r", "--repeat", type=int, help="Timed repetitions per size", default=50)
+
+startup = bench_subparsers.add_parser("startup", help="Fresh process import and first call cost")
+startup.add_argument("-r", "--repeat", type=int, help="Fresh processes to start", default=10)
+
+homography = bench_subparsers.add_parser("homography", help="Floor homography vs per-marker solvePnP accuracy and cost")
+homography.add_argument("-n", "--robots", type=int, help="Robots on the floor", default=50)
+homography.add_argument("-s", "--size", type=float, help="Marker size (meters)", default=0.05)
+homography.add_argument("-e", "--noise", type=float, help="Corner noise (pixels)", default=0.3)
+homography.add_argument("-r", "--repeat", type=int, help="Timed repetitions", default=50)
+
+arena = bench_subparsers.add_parser("arena", help="Synthetic arena suite: pose, controllers, drawing and UDP transport")
+arena.add_argument("-n", "--robots", type=int, nargs="+", help="Markers in the synthetic frames", default=[10, 50])
+arena.add_argument("-R", "--resolution", type=str, nargs="+", help="Frame resolutions WIDTHxHEIGHT", default=["640x480", "1280x720"])
+arena.add_argument("-e", "--noise", type=float, help="Gaussian pixel noise (grey levels)", default=4.0)
+arena.add_argument("-d", "--dct", type=str, help="ArUco dictionary (default: calib_params.yaml or aruco.DICT_ARUCO_ORIGINAL)", default=None)
+arena.add_argument("-c", "--ctr_sizes", type=int, nargs="+", help="Swarm sizes for the controllers", default=[1, 10, 50, 100, 200, 500])
+arena.add_argument("-t", "--time", type=float, help="Time budget per measurement (seconds)", default=0.2)
+arena.add_argument("-s", "--seed", type=int, help="Random seed of the arena", default=0)
+arena.add_argument("-o", "--output", type=str, help="Write the results as JSON to this file", default=None)
+arena.add_argument("-b", "--baseline", type=str, help="Results JSON to compare against", default=None)
+arena.add_argument("-T", "--threshold", type=float, help="Slowdown ratio flagged as a regression", default=0.15)
+
+sim = bench_subparsers.add_parser("sim", help="Closed loop simulator speed against real time")
+sim.add_argument("-n", "--sizes", type=int, nargs="+", help="Swarm sizes", default=[1, 10, 50, 200, 500])
+sim.add_argument("-d", "--duration", type=float, help="Simulated seconds", default=30.0)
+sim.add_argument("-f", "--fps", type=float, help="Control loop rate (Hz)", default=30.0)
+
+CTR_PARAMS = [0.03, 0.1, 1.0, 40, 2.0, 0.5, 1.0, 80]
+
+STARTUP_SCRIPT = '''
+import time, json
+t0 = time.perf_counter()
+import ucorobot
+t1 = time.perf_counter()
+pose = ucorobot.np.zeros((4, 3))
+goal = ucorobot.np.ones((4, 3))*100
+wl = ucorobot.np.zeros(4)
+wr = ucorobot.np.zeros(4)
+ucorobot.MIMC_VADOC_batch(pose, goal, [0.03, 0.1, 1.0, 40, 2.0, 0.5, 1.0, 80], wl, wr)
+t2 = time.perf_counter()
+ucorobot.cv2.getTickCount()
+t3 = time.perf_counter()
+print(json.dumps([t1 - t0, t2 - t1, t3 - t2]))
+'''
+
+def timeit(fn, repeat):
+
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+
+    return (time.perf_counter() - t0)/repeat
+
+def measure(fn, budget):
+    
+    #-- Median call time (ms) over as many calls as fit in budget seconds
+    t0 = time.perf_counter()
+    fn()
+    first = time.perf_counter() - t0
+    samples = []
+    for _ in range(max(3, min(1000, int(budget/max(first, 1e-6))))):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    
+    return float(np.median(samples))*1e3
+
+def bench_repulsion(sizes, L0, area, repeat):
+
+    rng = np.random.default_rng(0)
+    crossover = None
+
+    print("----- REPULSION NEIGHBOUR SEARCH -----")
+    print(" ")
+    print("{:>6} {:>12} {:>12}".format("N", "pairs [ms]", "grid [ms]"))
+
+    for size_in in sizes:
+        side = L0*np.sqrt(area*size_in)
+        robot_POSE = np.c_[rng.uniform(0, side, (size_in, 2)), rng.uniform(-180, 180, size_in)]
+
+        t_pairs = timeit(lambda: ucorobot.MIMC_VADOC_repulsion(robot_POSE, 1.0, L0, "pairs"), repeat)
+        t_grid = timeit(lambda: ucorobot.MIMC_VADOC_repulsion(robot_POSE, 1.0, L0, "grid"), repeat)
+        if crossover is None and t_grid < t_pairs:
+            crossover = size_in
+
+        print("{:>6} {:>12.4f} {:>12.4f}".format(size_in, t_pairs*1e3, t_grid*1e3))
+
+    print(" ")
+    print("Grid index faster from N = "+str(crossover))
+
+    return crossover
+
+def bench_startup(repeat):
+
+    #-- Every sample is a fresh interpreter so nothing is cached in-process
+    d = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=d + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    samples = []
+
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=d, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        samples.append([time.perf_counter() - t0] + json.loads(out))
+
+    samples = np.median(np.array(samples), axis=0)*1e3
+
+    print("----- STARTUP COST (median of "+str(repeat)+" processes) -----")
+    print(" ")
+    print("Process start to exit      --> {:.1f} ms".format(samples[0]))
+    print("import ucorobot            --> {:.1f} ms".format(samples[1]))
+    print("First controller call      --> {:.1f} ms".format(samples[2]))
+    print("First OpenCV use (lazy)    --> {:.1f} ms".format(samples[3]))
+
+    return samples
+
+def bench_homography(size_in, marker_size, noise, repeat):
+
+    #-- Synthetic camera 2 m over a 3x2 m floor, tilted 25 deg
+    rng = np.random.default_rng(0)
+    cv2 = ucorobot.cv2
+    mtx = np.array([[900.0, 0, 640], [0, 900.0, 360], [0, 0, 1]])
+    dist = np.zeros(5)
+    R_cf = cv2.Rodrigues(np.array([np.pi - np.radians(25), 0, 0]))[0]
+    t_cf = -R_cf @ np.array([1.5, 0.2, 2.0])
+
+    def project(xy, yaw):
+        h = marker_size/2
+        local = np.array([[-h, h], [h, h], [h, -h], [-h, -h]])
+        c, s = np.cos(yaw)[:, None], np.sin(yaw)[:, None]
+        pts = np.stack([c*local[:, 0] - s*local[:, 1], s*local[:, 0] + c*local[:, 1]], axis=-1) + xy[:, None]
+        pts = np.concatenate([pts, np.zeros(pts.shape[:2] + (1,))], axis=-1).reshape(-1, 3)
+        img = cv2.projectPoints(pts, cv2.Rodrigues(R_cf)[0], t_cf, mtx, dist)[0].reshape(-1, 1, 4, 2)
+        return list((img + rng.normal(0, noise, img.shape)).astype(np.float32))
+
+    #-- Reference markers at known floor positions give the homography
+    ref_xy = np.array([[0.2, 0.2], [2.8, 0.2], [2.8, 1.8], [0.2, 1.8], [1.5, 1.0]])
+    H = ucorobot.estimate_homography(project(ref_xy, np.zeros(len(ref_xy))), np.arange(len(ref_xy)),
+                                     {i: p for i, p in enumerate(ref_xy)})
+
+    xy = np.c_[rng.uniform(0.3, 2.7, size_in), rng.uniform(0.3, 1.7, size_in)]
+    yaw = rng.uniform(-np.pi, np.pi, size_in)
+    corners = project(xy, yaw)
+
+    def solve_pnp():
+        h = marker_size/2
+        obj = np.array([[-h, h, 0], [h, h, 0], [h, -h, 0], [-h, -h, 0]])
+        out = np.zeros((size_in, 3))
+        for m, c in enumerate(corners):
+            _, rvec, tvec = cv2.solvePnP(obj, c.reshape(4, 2), mtx, dist, flags=cv2.SOLVEPNP_IPPE_SQUARE)
+            R = R_cf.T @ cv2.Rodrigues(rvec)[0]
+            out[m, 0:2] = (R_cf.T @ (tvec.ravel() - t_cf))[0:2]
+            out[m, 2] = np.degrees(np.arctan2(R[1, 0], R[0, 0]))
+        return out
+
+    def errors(est):
+        d_yaw = (est[:, 2] - np.degrees(yaw) + 180) % 360 - 180
+        return np.median(np.linalg.norm(est[:, 0:2] - xy, axis=1))*1e3, np.median(np.abs(d_yaw))
+
+    results = {}
+    for name, fn in (("homography", lambda: ucorobot.floor_poses(corners, H)), ("solvePnP", solve_pnp)):
+        results[name] = (timeit(fn, repeat),) + errors(fn())
+
+    print("----- FLOOR POSE ("+str(size_in)+" markers, "+str(noise)+" px noise) -----")
+    print(" ")
+    print("{:>12} {:>10} {:>12} {:>12}".format("", "[ms]", "pos [mm]", "yaw [deg]"))
+    for name, (t, e_pos, e_yaw) in results.items():
+        print("{:>12} {:>10.3f} {:>12.2f} {:>12.2f}".format(name, t*1e3, e_pos, e_yaw))
+
+    return results
+
+def render_arena(dictionary, ids, width, height, noise, rng):
+    
+    #-- White floor with one rotated marker per robot on a jittered grid.
+    #-- Returns the grey frame and the ground truth [x, y, angle] per marker
+    #-- in the get_pose pixel convention.
+    size_in = len(ids)
+    cols = int(np.ceil(np.sqrt(size_in*width/height)))
+    rows = int(np.ceil(size_in/cols))
+    cell = min(width/cols, height/rows)
+    px = int(cell/1.6)
+    if px < 16:
+        print("Resolution "+str(width)+"x"+str(height)+" too small for "+str(size_in)+" markers")
+        sys.exit(0)
+    
+    frame = np.full((height, width), 255, dtype=np.uint8)
+    truth = np.zeros((size_in, 3))
+    patch = int(np.ceil(px*1.5))
+    
+    for k, i in enumerate(ids):
+        img = np.full((patch, patch), 255, dtype=np.uint8)
+        o = (patch - px)//2
+        img[o:o + px, o:o + px] = ucorobot.aruco.drawMarker(dictionary, int(i), px)
+        c = o + (px - 1)/2
+        ang = rng.uniform(-180, 180)
+        M = ucorobot.cv2.getRotationMatrix2D((c, c), ang, 1.0)
+        img = ucorobot.cv2.warpAffine(img, M, (patch, patch), borderValue=255)
+        
+        x0 = int((k % cols)*cell + rng.uniform(0, cell - patch))
+        y0 = int((k // cols)*cell + rng.uniform(0, cell - patch))
+        frame[y0:y0 + patch, x0:x0 + patch] = np.minimum(frame[y0:y0 + patch, x0:x0 + patch], img)
+        truth[k] = x0 + c, y0 + c, ang
+    
+    frame = np.clip(frame + rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+    
+    return frame, truth
+
+def arena_config(ids, dct, width, height, mtx):
+    
+    #-- Configuration files initialize() reads, in the current directory
+    cv2 = ucorobot.cv2
+    f = cv2.FileStorage("calib_params.yaml", cv2.FILE_STORAGE_WRITE)
+    f.write("mtx", mtx)
+    f.write("dist", np.zeros((1, 5)))
+    f.write("dct", dct)
+    f.write("cam", 0)
+    f.write("width", width)
+    f.write("height", height)
+    f.write("marker_size", 0.05)
+    f.release()
+    f = cv2.FileStorage("robot_assign.yaml", cv2.FILE_STORAGE_WRITE)
+    f.write("robot_IDS", np.asarray(ids).reshape(-1, 1))
+    f.release()
+    
+    ucorobot.calib_cache.clear()
+
+def bench_control_transport(ctr_sizes, budget, rng, results):
+    
+    for size_in in ctr_sizes:
+        side = 80*np.sqrt(9*size_in)
+        robot_POSE = np.c_[rng.uniform(0, side, (size_in, 2)), rng.uniform(-180, 180, size_in)]
+        robot_GOAL = np.c_[rng.uniform(0, side, (size_in, 2)), np.zeros(size_in)]
+        robot_IDS = np.arange(size_in)
+        ucorobot.wl = np.zeros(size_in)
+        ucorobot.wr = np.zeros(size_in)
+        ucorobot.F = np.zeros((size_in, 2))
+        wl = np.zeros(size_in)
+        wr = np.zeros(size_in)
+        tag = "N="+str(size_in)
+        
+        results["MIMC_VADOC_batch/"+tag] = measure(
+            lambda: ucorobot.MIMC_VADOC_batch(robot_POSE, robot_GOAL, CTR_PARAMS, wl, wr), budget)
+        results["MIMC_VADOC_multiple/"+tag] = measure(
+            lambda: ucorobot.MIMC_VADOC_multiple(robot_POSE, robot_IDS, robot_GOAL, CTR_PARAMS), budget)
+        results["MIMC_VADOC_multiple_2/"+tag] = measure(
+            lambda: ucorobot.MIMC_VADOC_multiple_2(robot_POSE, robot_IDS, robot_GOAL, CTR_PARAMS), budget)
+        if size_in == 1:
+            results["MIMC_VADOC_single/"+tag] = measure(
+                lambda: ucorobot.MIMC_VADOC_single(robot_POSE[0], robot_GOAL[0], CTR_PARAMS), budget)
+    
+    #-- Loopback transport, a sink socket stands in for every robot
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.2", 0))
+    port = sink.getsockname()[1]
+    for size_in in ctr_sizes:
+        tr_data = rng.uniform(-300, 300, (size_in, 2))
+        for wire, group in (("ascii", None), ("binary", None), ("binary", "127.255.255.255")):
+            ucorobot.initialize_UDP(list(range(size_in)), "127.0.0.1", port, ["127.0.0.2"]*size_in, "DIRECT", wire, group)
+            name = "swarm" if group is not None else wire
+            results["transmission_UDP/"+name+"/N="+str(size_in)] = measure(
+                lambda: ucorobot.transmission_UDP("DIRECT", tr_data.copy()), budget)
+            ucorobot.UDP_close()
+    sink.close()
+
+def bench_arena(robots, resolutions, noise, dct, ctr_sizes, budget, seed):
+    
+    rng = np.random.default_rng(seed)
+    if dct is None:
+        dct = ucorobot.read_calib()[2] if os.path.exists("calib_params.yaml") else "aruco.DICT_ARUCO_ORIGINAL"
+    
+    results = {}
+    accuracy = {}
+    cwd = os.getcwd()
+    
+    print("----- SYNTHETIC ARENA -----")
+    print(" ")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            dictionary = ucorobot.get_detector(dct)[0]
+            
+            for res in resolutions:
+                width, height = (int(v) for v in res.lower().split("x"))
+                mtx = np.array([[float(width), 0, width/2], [0, float(width), height/2], [0, 0, 1]])
+                dist = np.zeros((1, 5))
+                
+                for size_in in robots:
+                    ids = np.arange(size_in)
+                    arena_config(ids, dct, width, height, mtx)
+                    robot_IDS, size_in = ucorobot.initialize()
+                    gray, truth = render_arena(dictionary, ids, width, height, noise, rng)
+                    frame = ucorobot.cv2.cvtColor(gray, ucorobot.cv2.COLOR_GRAY2BGR)
+                    tag = "N="+str(size_in)+"/"+res
+                    
+                    for mode in (0, 1):
+                        results["get_pose/mode"+str(mode)+"/"+tag] = measure(
+                            lambda: ucorobot.get_pose(gray, mode, mtx, dist, robot_IDS, size_in), budget)
+                    
+                    #-- Detection sanity check of the rendered arena
+                    pose = ucorobot.get_pose(gray, 0, mtx, dist, robot_IDS, size_in).copy()
+                    found = ucorobot.robot_STORE['valid']
+                    err = np.linalg.norm(pose[found, 0:2] - truth[found, 0:2], axis=1)
+                    d_ang = np.abs((pose[found, 2] - truth[found, 2] + 180) % 360 - 180)
+                    accuracy[tag] = {"found": float(found.mean()),
+                                     "pos_px": float(np.median(err)) if found.any() else None,
+                                     "ang_deg": float(np.median(d_ang)) if found.any() else None}
+                    
+                    for mode in (0, 1):
+                        results["draw_robots/mode"+str(mode)+"/"+tag] = measure(
+                            lambda: ucorobot.draw_robots(frame.copy(), pose, robot_IDS, mode), budget)
+                    
+                    print(tag+" --> found "+str(round(100*accuracy[tag]["found"], 1))+" % of the markers")
+        finally:
+            os.chdir(cwd)
+    
+    #-- UDP setup prints the connection mode, keep the report readable
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        bench_control_transport(ctr_sizes, budget, rng, results)
+    
+    print(" ")
+    print("{:<44} {:>12}".format("benchmark", "[ms]"))
+    for name, t in results.items():
+        print("{:<44} {:>12.4f}".format(name, t))
+    
+    return {"meta": {"python": platform.python_version(), "numpy": np.__version__,
+                     "opencv": ucorobot.cv2.__version__, "machine": platform.machine(),
+                     "dct": dct, "noise": noise, "seed": seed, "time": time.time()},
+            "results": results,
+            "accuracy": accuracy}
+
+def bench_sim(sizes, duration, fps):
+    
+    rng = np.random.default_rng(0)
+    steps = int(duration*fps)
+    
+    print("----- SIMULATOR ("+str(duration)+" s at "+str(fps)+" Hz) -----")
+    print(" ")
+    print("{:>6} {:>12} {:>14}".format("N", "wall [s]", "x real time"))
+    
+    for size_in in sizes:
+        side = 80*np.sqrt(9*size_in)
+        robot_POSE = np.c_[rng.uniform(0, side, (size_in, 2)), rng.uniform(-180, 180, size_in)]
+        robot_GOAL = np.c_[rng.uniform(0, side, (size_in, 2)), np.zeros(size_in)]
+        ucorobot.initialize_sim(robot_POSE, CTR_PARAMS, dt=1/fps, noise=(0.5, 1.0), latency=2/fps, seed=0)
+        
+        t0 = time.perf_counter()
+        ucorobot.sim_run(robot_GOAL, CTR_PARAMS, steps)
+        wall = time.perf_counter() - t0
+        
+        print("{:>6} {:>12.3f} {:>14.1f}".format(size_in, wall, duration/wall))
+
+def compare_baseline(report, baseline, threshold):
+    
+    #-- Benchmarks slower than baseline by more than threshold (ratio - 1)
+    with open(baseline) as f:
+        base = json.load(f)["results"]
+    
+    regressions = []
+    print(" ")
+    print("----- BASELINE COMPARISON (threshold "+str(round(100*threshold))+" %) -----")
+    print(" ")
+    print("{:<44} {:>10} {:>10} {:>8}".format("benchmark", "base [ms]", "now [ms]", "ratio"))
+    for name, t in report["results"].items():
+        if name not in base:
+            continue
+        ratio = t/max(base[name], 1e-9)
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- REGRESSION"
+            regressions.append(name)
+        print("{:<44} {:>10.4f} {:>10.4f} {:>8.2f}{}".format(name, base[name], t, ratio, flag))
+    
+    print(" ")
+    print(str(len(regressions))+" regression(s)")
+    
+    return regressions
+
+if __name__ == "__main__":
+
+    args = Bench.parse_args()
+
+    if args.bench == "repulsion":
+        bench_repulsion(args.sizes, args.L0, args.area, args.repeat)
+    elif args.bench == "startup":
+        bench_startup(args.repeat)
+    elif args.bench == "arena":
+        report = bench_arena(args.robots, args.resolution, args.noise, args.dct, args.ctr_sizes, args.time, args.seed)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=1)
+        if args.baseline is not None and compare_baseline(report, args.baseline, args.threshold):
+            sys.exit(1)
+    elif args.bench == "sim":
+        bench_sim(args.sizes, args.duration, args.fps)
+    elif args.bench == "homography":
+        bench_homography(args.robots, args.size, args.noise, args.repeat)
+    else:
+        Bench.print_help()